@@ -1,22 +1,163 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from app.model.schemas import ChatRequest
-from app.services.chat_service import process_chat
+import asyncio
+from contextlib import aclosing
+import json
+import os
+from typing import Optional
+import uuid
+
+from fastapi import APIRouter, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
+
+from app.model.llm_model import generation_options, models
+from app.model.schemas import ChatBatchRequest, ChatRequest
+from app.services.chat_service import BATCH_MAX_ITEMS, aprocess_batch, aprocess_chat, astream_chat
+from app.services.idempotency import IdempotencyConflict, idempotent_turns
+from app.services.metrics import websocket_connections
+from app.services.model_router import model_router
+from app.services.rate_limit import RateLimited, rate_limiter
+from app.services.scheduler import Overloaded, current_flow, llm_scheduler
+from app.services.tracing import traced
+
+# Messages of one WebSocket connection generating at the same time
+# (more are rejected until one finishes)
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "8"))
+# Frames waiting to be sent to a slow client before generation pauses
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))
+
+# Status for requests whose client went away (nginx uses the same code)
+CLIENT_CLOSED_REQUEST = 499
 
 # Create router
 router = APIRouter()
 
+
+def client_address(connection: HTTPConnection):
+    """
+    Client IP for rate limits. Behind a proxy, run uvicorn with
+    --forwarded-allow-ips so this is the real client, not the proxy.
+    """
+    return connection.client.host if connection.client else None
+
+
+def admit(session_id: str, connection: HTTPConnection):
+    """
+    Rate limits for a new chat message (RateLimited if over one). Its LLM
+    calls then queue in the client's flow (see AdmissionController).
+    """
+    client = client_address(connection)
+    rate_limiter.admit(session_id, client)
+    current_flow.set(client)
+
+
+def request_options(request: ChatRequest) -> dict:
+    """
+    Generation options of one chat request.
+    """
+    return generation_options(request.temperature, request.max_tokens, request.num_ctx)
+
+
+def check_model(request: ChatRequest):
+    """
+    Only models in the registry may be asked for (422 otherwise).
+    """
+    if request.model is not None and request.model not in models:
+        raise HTTPException(status_code=422, detail=f"Unknown model {request.model!r}, see GET /chat/models")
+
+
+def reply_chunks(request: ChatRequest, key: str = None):
+    """
+    Streamed reply to a chat request. With a key, a retry of the same
+    message attaches to (or replays) the first attempt.
+    """
+    options = request_options(request)
+    if key is None:
+        return astream_chat(request.session_id, request.message, options, request.model)
+    return idempotent_turns.stream(
+        request.session_id, key, request.message, options,
+        lambda: astream_chat(request.session_id, request.message, options, request.model),
+        request.model,
+    )
+
+
+class ClientDisconnected(Exception):
+    """
+    The HTTP client closed the connection before the reply was ready.
+    """
+
+
+async def _wait_for_disconnect(request: Request):
+    # The body is already read, so the next ASGI message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _unless_disconnected(request: Request, awaitable):
+    """
+    Await `awaitable`, but cancel it as soon as the client disconnects
+    (which aborts the generation upstream) and raise ClientDisconnected.
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        watcher.cancel()
+        raise
+
+    watcher.cancel()
+    if work in done:
+        return work.result()
+
+    work.cancel()
+    # Let the cancelled turn finish unwinding (close upstream, free its slot)
+    await asyncio.wait({work})
+    raise ClientDisconnected()
+
+
 @router.post("/chat")
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
     """
     This is the API endpoint.
     Frontend sends data here.
+
+    Clients that retry should send the same Idempotency-Key header with
+    every attempt: a retry then waits for the first attempt's reply (or
+    gets it again if it already finished) instead of generating and
+    saving the turn twice.
+
+    Over a rate limit this fails with 429 and Retry-After.
     """
 
-    # Call service layer
-    response = process_chat(
-        session_id=request.session_id,
-        user_message=request.message
-    )
+    check_model(request)
+    # Before any LLM work: RateLimited becomes a 429 (Overloaded handler)
+    admit(request.session_id, http_request)
+
+    options = request_options(request)
+    if idempotency_key is None:
+        turn = aprocess_chat(request.session_id, request.message, options, request.model)
+    else:
+        turn = idempotent_turns.run(
+            request.session_id, idempotency_key, request.message, options,
+            lambda: aprocess_chat(request.session_id, request.message, options, request.model),
+            request.model,
+        )
+
+    # Call service layer (async, so the worker keeps serving others).
+    # If the client gives up, the generation is cancelled too
+    # (with a key, only if no retry shows up within IDEMPOTENCY_GRACE).
+    try:
+        response = await _unless_disconnected(http_request, turn)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
 
     # Return response as JSON
     return {
@@ -24,38 +165,292 @@ def chat_endpoint(request: ChatRequest):
     }
 
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+
+    Sends one event per chunk:
+    data: {"delta": "<text>"}
+
+    And a final event with the full reply:
+    data: {"response": "<assistant reply>", "done": true}
+
+    If the server is overloaded this fails with 503 before
+    the stream starts (see the Overloaded handler in main.py).
+    If the reply breaks off after it started, the last event is
+    data: {"error": "<text>", "retry_after": 1}
+    and nothing is saved.
+    If the client disconnects, the generation is cancelled.
+    Idempotency-Key works as in /chat; a retry gets the whole
+    reply from the start.
+    """
+
+    check_model(request)
+    admit(request.session_id, http_request)
+    deltas = reply_chunks(request, idempotency_key)
+
+    # Wait for the first chunk before sending headers, so queue
+    # rejections still become a proper HTTP error status
+    try:
+        first = await _unless_disconnected(http_request, deltas.__anext__())
+    except StopAsyncIteration:
+        first = None
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+    async def event_stream():
+        # Closing `deltas` when the stream stops (client gone) aborts the generation
+        async with aclosing(deltas):
+            parts = []
+            if first is not None:
+                parts.append(first)
+                yield f"data: {json.dumps({'delta': first})}\n\n"
+
+            try:
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+            except Overloaded as e:
+                # Headers are out already -> report it in the stream
+                yield f"data: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
+                return
+
+            done = {"response": "".join(parts), "done": True}
+            yield f"data: {json.dumps(done)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/chat/batch")
+async def chat_batch_endpoint(request: ChatBatchRequest, http_request: Request):
+    """
+    Many chat messages in one request, for bulk jobs.
+
+    Body: {"items": [{"session_id": "...", "message": "..."}, ...]}
+    (each item may have its own generation settings, as in /chat)
+
+    Streams newline-delimited JSON, one line per item as soon as it
+    finishes (not in input order):
+    {"index": 3, "session_id": "...", "response": "..."}
+    {"index": 5, "session_id": "...", "error": "...", "retry_after": 2}
+    (an item asking for an unknown model only fails that item)
+
+    And a summary line at the end:
+    {"done": true, "count": 100, "errors": 1}
+
+    A batch counts as one request for the client's rate limit (session
+    limits don't apply); all generated tokens go to its token budget.
+    """
+
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    admit(None, http_request)
+
+    async def results():
+        errors = 0
+        options = [request_options(item) for item in request.items]
+        async for result in aprocess_batch(request.items, options):
+            errors += "error" in result
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "count": len(request.items), "errors": errors}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 @router.websocket("/ws")
 async def websocket_chat(websocket: WebSocket):
     """WebSocket endpoint for real-time chat.
 
     Expects messages as JSON objects:
-    {"session_id": "<id>", "message": "<text>"}
+    {"session_id": "<id>", "message": "<text>", "stream": true, "request_id": "<id>"}
+
+    While the reply is generated it sends incremental frames:
+    {"delta": "<text chunk>", "request_id": "<id>"}
+
+    And finally the full reply:
+    {"response": "<assistant reply>", "done": true, "request_id": "<id>"}
 
-    Sends back JSON:
-    {"response": "<assistant reply>"}
+    Send "stream": false to get only the final frame. Generation
+    settings ("temperature", "max_tokens", "num_ctx", "model") work as in /chat.
+
+    Several messages (for the same or different sessions) may be in
+    flight at once; every frame carries the "request_id" of its message
+    (made up by the server if the client didn't send one). A message may
+    also carry an "idempotency_key": resending it with the same key (e.g.
+    after reconnecting) streams the same reply again from the start
+    instead of generating a new turn. Messages of
+    one session still run in order. At most WS_MAX_IN_FLIGHT messages
+    of a connection run at once; more are rejected with an error frame,
+    as are messages over a rate limit (both with "retry_after").
+    If the client reads slowly, generation pauses once WS_SEND_QUEUE
+    frames are waiting.
+
+    To stop a reply nobody needs any more (e.g. the client timed out):
+    {"cancel": "<request_id>"}  ->  {"cancelled": true, "request_id": "<id>"}
+    Cancelled and unfinished replies are not saved to the history;
+    closing the connection cancels everything still in flight.
     """
 
     await websocket.accept()
+    websocket_connections.inc()
+
+    outbox = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+    sender = asyncio.create_task(_send_frames(websocket, outbox))
+    # request_id -> (task, session_id, idempotency key)
+    in_flight = {}
+
+    def finished(task: asyncio.Task, request_id: str):
+        # A cancelled id may already be reused by a newer message
+        if in_flight.get(request_id, (None,))[0] is task:
+            del in_flight[request_id]
+
     try:
         while True:
             data = await websocket.receive_json()
+
+            if "cancel" in data:
+                request_id = data["cancel"]
+                entry = in_flight.pop(request_id, None)
+                if entry is None:
+                    await outbox.put({"error": "no such request in flight", "request_id": request_id})
+                    continue
+                # Stops the generation upstream; frames already queued still go out first
+                task, session_id, key = entry
+                task.cancel()
+                if key is not None:
+                    idempotent_turns.cancel(session_id, key)
+                await outbox.put({"cancelled": True, "request_id": request_id})
+                continue
+
             session_id = data.get("session_id")
             message = data.get("message")
+            request_id = data.get("request_id") or uuid.uuid4().hex
+            key = data.get("idempotency_key") or None
 
             if not session_id or message is None:
-                await websocket.send_json({
-                    "error": "session_id and message are required"
+                await outbox.put({
+                    "error": "session_id and message are required",
+                    "request_id": request_id,
                 })
                 continue
 
-            response = process_chat(
-                session_id=session_id,
-                user_message=message,
-            )
+            try:
+                chat = ChatRequest(**data)
+            except ValidationError as e:
+                problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                await outbox.put({"error": f"Invalid message: {problems}", "request_id": request_id})
+                continue
 
-            await websocket.send_json({
-                "response": response
-            })
+            if chat.model is not None and chat.model not in models:
+                await outbox.put({"error": f"Unknown model {chat.model!r}", "request_id": request_id})
+                continue
+
+            if request_id in in_flight:
+                await outbox.put({
+                    "error": "request_id is already in flight",
+                    "request_id": request_id,
+                })
+                continue
+
+            if len(in_flight) >= WS_MAX_IN_FLIGHT:
+                await outbox.put({
+                    "error": "Too many messages in flight on this connection",
+                    "retry_after": 1,
+                    "request_id": request_id,
+                })
+                continue
+
+            try:
+                # The turn's task inherits the token budgets and queue flow set here
+                admit(chat.session_id, websocket)
+            except RateLimited as e:
+                await outbox.put({"error": str(e), "retry_after": e.retry_after, "request_id": request_id})
+                continue
+
+            task = asyncio.create_task(
+                _websocket_turn(outbox, request_id, reply_chunks(chat, key), data.get("stream", True))
+            )
+            in_flight[request_id] = (task, chat.session_id, key)
+            task.add_done_callback(lambda done, rid=request_id: finished(done, rid))
     except WebSocketDisconnect:
         # Client disconnected; just end the connection gracefully
         pass
+    finally:
+        for task, _, _ in list(in_flight.values()):
+            task.cancel()
+        sender.cancel()
+        websocket_connections.dec()
+
+
+async def _websocket_turn(outbox: asyncio.Queue, request_id: str, chunks, stream: bool):
+    """
+    One WebSocket message: generate the reply (`chunks`) and queue its frames.
+    """
+    with traced("websocket_chat", request_id):
+        parts = []
+        try:
+            # aclosing: a cancelled message closes its generation right away
+            async with aclosing(chunks) as deltas:
+                async for delta in deltas:
+                    parts.append(delta)
+                    if stream:
+                        await outbox.put({"delta": delta, "request_id": request_id})
+        except Overloaded as e:
+            await outbox.put({
+                "error": str(e),
+                "retry_after": e.retry_after,
+                "request_id": request_id,
+            })
+            return
+        except IdempotencyConflict as e:
+            await outbox.put({"error": str(e), "request_id": request_id})
+            return
+        except Exception as e:
+            print(f"WebSocket message {request_id} failed: {e!r}")
+            await outbox.put({"error": "internal error", "request_id": request_id})
+            return
+
+        await outbox.put({
+            "response": "".join(parts),
+            "done": True,
+            "request_id": request_id,
+        })
+
+
+async def _send_frames(websocket: WebSocket, outbox: asyncio.Queue):
+    """
+    The only task writing to the socket, so frames never interleave.
+    """
+    try:
+        while True:
+            await websocket.send_json(await outbox.get())
+    except (WebSocketDisconnect, RuntimeError):
+        # Connection closed; the receive loop cleans up
+        pass
+
+
+@router.get("/chat/queue")
+def queue_status():
+    """
+    Current LLM queue depth, wait times and rejection counters.
+    """
+    return llm_scheduler.stats()
+
+
+@router.get("/chat/models")
+def models_status():
+    """
+    Models clients may ask for, how turns were routed, and the latency
+    of each model (to tune the ROUTER_SMALL_* thresholds).
+    """
+    return model_router.stats()
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import PlainTextResponse
+
+from app.services.profiler import profiler
+from app.services.tracing import slowest_traces
+
+# Create router (only registered when DEBUG_ENDPOINTS is on, see main.py)
+router = APIRouter(prefix="/debug")
+
+
+@router.get("/traces")
+def get_traces():
+    """
+    The slowest recent requests with their spans, slowest first.
+    """
+    return {"traces": slowest_traces.snapshot()}
+
+
+@router.delete("/traces")
+def clear_traces():
+    slowest_traces.clear()
+    return {"cleared": True}
+
+
+@router.post("/profiler/start")
+def start_profiler(interval: float = Query(None, ge=0.001)):
+    """
+    Start the sampling profiler (interval = seconds between samples,
+    at least 1 ms so the sampler can't hog the GIL).
+    """
+    profiler.start(interval)
+    return profiler.stats()
+
+
+@router.post("/profiler/stop")
+def stop_profiler():
+    profiler.stop()
+    return profiler.stats()
+
+
+@router.get("/profiler", response_class=PlainTextResponse)
+def profiler_report(limit: int = None):
+    """
+    Sampled stacks in collapsed format (feed to flamegraph.pl or speedscope).
+    """
+    return PlainTextResponse(profiler.report(limit))
@@ -0,0 +1,67 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.model.chat_memory import chat_sessions
+from app.model.llm_model import ollama_pool, session_contexts
+from app.services.metrics import register_counter, register_gauge, registry
+from app.services.rate_limit import rate_limiter
+from app.services.response_cache import response_cache
+from app.services.scheduler import llm_scheduler
+
+# Create router
+router = APIRouter()
+
+# Gauges read only when /metrics is scraped
+register_gauge("chat_active_sessions", "Sessions held in memory", lambda: len(chat_sessions))
+register_gauge("chat_session_resident_bytes", "Approximate memory of the sessions held", lambda: chat_sessions.resident_bytes)
+register_counter(
+    "chat_session_evictions_total", "Sessions dropped from memory, by limit hit", lambda: {
+        "lru": chat_sessions.evicted_lru,
+        "bytes": chat_sessions.evicted_bytes,
+        "ttl": chat_sessions.evicted_ttl,
+    },
+    label="reason",
+)
+register_gauge("chat_response_cache_entries", "Replies held in the response cache's memory", lambda: len(response_cache))
+register_counter(
+    "chat_response_cache_lookups_total", "Exact-match response cache lookups, by result", lambda: {
+        "hit": response_cache.hits,
+        "disk_hit": response_cache.disk_hits,
+        "miss": response_cache.misses,
+    },
+    label="result",
+)
+register_counter(
+    "chat_response_cache_evictions_total", "Replies pushed out of the response cache's memory",
+    lambda: response_cache.evictions,
+)
+register_gauge("chat_llm_context_sessions", "Sessions with Ollama context tokens kept (LLM_API=context)", lambda: len(session_contexts))
+register_counter(
+    "chat_llm_context_turns_total", "Turns in LLM_API=context mode, by whether the saved context was reused", lambda: {
+        "reused": session_contexts.reused,
+        "fallback": session_contexts.fallbacks,
+    },
+    label="result",
+)
+register_gauge("chat_llm_queue_depth", "Requests waiting for an LLM slot", lambda: llm_scheduler.queued)
+register_gauge("chat_llm_active", "LLM generations running", lambda: llm_scheduler.active)
+register_gauge("chat_rate_limit_buckets", "Rate limit buckets held in memory", lambda: sum(rate_limiter.stats().values()))
+
+
+@router.get("/health")
+def health():
+    """
+    Is the API up, and which Ollama backends can it reach right now?
+    """
+    return {
+        "status": "ok",
+        "ollama": ollama_pool.stats(),
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Latencies, counters and gauges in Prometheus text format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,50 @@
+from contextlib import asynccontextmanager
+import os
+
 # Import FastAPI framework
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 # Import controller (router)
 from app.controllers.chat_controller import router as chat_router
+from app.controllers.debug_controller import router as debug_router
+from app.controllers.status_controller import router as status_router
+from app.model.chat_memory import close_storage
+from app.model.llm_model import close_http_client, start_health_checks, stop_health_checks, warm_up
+from app.services.idempotency import IdempotencyConflict
+from app.services.profiler import profiler
+from app.services.scheduler import Overloaded
+from app.services.tracing import TracingMiddleware
+
+# Serve /debug/traces and the profiler switch ("1" to enable; they are
+# unauthenticated, so keep them off on anything reachable from outside)
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "0") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup / shutdown hook.
+    Code before `yield` runs on startup, code after it on shutdown.
+    """
+    # Load the model before serving, then keep checking each backend's health
+    await warm_up()
+    start_health_checks()
+
+    yield
+
+    await stop_health_checks()
+    profiler.stop()
+    # Close pooled connections to Ollama
+    await close_http_client()
+    # Write out queued chat messages
+    close_storage()
+
 
 # Create FastAPI app instance
 # This is the main backend application
-app = FastAPI(title="Local LLaMA Chat MVC")
+app = FastAPI(title="Local LLaMA Chat MVC", lifespan=lifespan)
 
 # Add CORS middleware to allow frontend to connect
 app.add_middleware(
@@ -16,10 +53,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read the timing headers
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
+# Request ID + per-stage timings on every HTTP request
+app.add_middleware(TracingMiddleware)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """
+    LLM queue is full (503), the session sends too fast (429) or the
+    backend broke off the reply (502) -> tell the client to come back later.
+    """
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(IdempotencyConflict)
+async def idempotency_conflict_handler(request: Request, exc: IdempotencyConflict):
+    """
+    Same Idempotency-Key, different message -> client bug, don't guess.
+    """
+    return JSONResponse(status_code=exc.status_code, content={"error": str(exc)})
+
 # Register chat routes (controllers)
 app.include_router(chat_router)
+app.include_router(status_router)
+if DEBUG_ENDPOINTS:
+    app.include_router(debug_router)
 
 # When you run:
 # uvicorn app.main:app --reload
@@ -1,28 +1,210 @@
-# Simple in-memory storage
+import atexit
+import multiprocessing
+import os
+import sys
+
+import anyio
+
+from app.model.session_store import SessionStore
+from app.model.storage import SQLiteStorage, StorageBackend, WriteBehindFlusher
+
+# In-memory storage with limits
 # Key = session_id
 # Value = list of messages
-chat_sessions = {}
+#
+# Least recently used sessions are evicted when there are too many,
+# when they take too much memory, or when they sit idle too long.
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+chat_sessions = SessionStore(
+    max_sessions=SESSION_MAX_COUNT,
+    max_bytes=SESSION_MAX_BYTES,
+    ttl_seconds=SESSION_TTL_SECONDS,
+)
+
+# -------------------------------
+# Durable storage
+# -------------------------------
+# CHAT_STORAGE = "sqlite" (default) or "memory" (nothing survives a restart)
+# Memory stays the hot cache; every message is also written to storage
+# in the background, and evicted sessions are loaded back on first use.
+CHAT_STORAGE = os.getenv("CHAT_STORAGE", "sqlite")
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "chat_history.db")
+
+# Max threads doing blocking storage reads at the same time
+STORAGE_IO_THREADS = int(os.getenv("STORAGE_IO_THREADS", "8"))
+
+# Several worker processes (uvicorn --workers N) serving the same sessions.
+# The SQLite database is then the source of truth: each worker's memory is
+# only a read cache, topped up with rows other workers added, and every
+# message is written through before the reply is returned (one synchronous
+# write per turn, so a single worker keeps the write-behind flusher).
+# On by default only when several workers are configured: WEB_CONCURRENCY
+# above 1, or this process is a uvicorn --workers child. Other process
+# managers (gunicorn, ...) need WEB_CONCURRENCY or CHAT_SHARED_SESSIONS=1.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def _uvicorn_worker() -> bool:
+    # uvicorn --workers (and --reload) runs the app in spawned child processes
+    return multiprocessing.parent_process() is not None and "uvicorn" in sys.modules
+
+
+CHAT_SHARED_SESSIONS = os.getenv(
+    "CHAT_SHARED_SESSIONS",
+    "1" if WEB_CONCURRENCY > 1 or _uvicorn_worker() else "0",
+) == "1"
+
+if not CHAT_SHARED_SESSIONS and WEB_CONCURRENCY > 1:
+    print(
+        "WARNING: WEB_CONCURRENCY > 1 but CHAT_SHARED_SESSIONS is off: every worker "
+        "keeps its own chat history and sessions will lose turns between workers"
+    )
+
+
+def create_storage() -> StorageBackend:
+    if CHAT_STORAGE == "sqlite" or CHAT_SHARED_SESSIONS:
+        return SQLiteStorage(CHAT_DB_PATH)
+    return StorageBackend()
+
+
+storage = create_storage()
+flusher = WriteBehindFlusher(storage)
+_io_limiter = anyio.CapacityLimiter(STORAGE_IO_THREADS)
+
+
+def close_storage():
+    """
+    Write out everything still queued and close the storage.
+    """
+    flusher.close()
+
+
+# Scripts using the chat functions directly don't have the FastAPI shutdown hook
+atexit.register(close_storage)
+
 
 def get_chat_history(session_id: str):
     """
     Returns previous messages for a session.
     If session does not exist, return empty list.
     """
-    return chat_sessions.get(session_id, [])
+    if CHAT_SHARED_SESSIONS:
+        return _sync_shared_history(session_id)
+
+    history = chat_sessions.get(session_id)
+    if history is not None:
+        return history
+
+    # Not in memory -> maybe it was evicted or the server restarted.
+    # Make sure queued writes of this session are on disk before reading.
+    if flusher.has_pending(session_id):
+        flusher.flush()
+
+    stored = storage.load(session_id)
+    # New sessions are kept too (empty), so saving their first turn
+    # doesn't look them up in storage again
+    return chat_sessions.put(session_id, stored if stored is not None else [])
+
+async def aget_chat_history(session_id: str):
+    """
+    Async get_chat_history. Cold sessions (and, with shared sessions,
+    the check for other workers' messages) are read from storage in a
+    worker thread, so the disk read does not block the event loop.
+    Hot sessions return immediately.
+    """
+    if not CHAT_SHARED_SESSIONS:
+        history = chat_sessions.get(session_id)
+        if history is not None:
+            return history
+    return await anyio.to_thread.run_sync(get_chat_history, session_id, limiter=_io_limiter)
 
-def save_message(session_id: str, role: str, content: str):
+def save_message(session_id: str, role: str, content: str, pinned: bool = False):
     """
     Save a message to memory.
-    role = 'user' or 'assistant'
+    role = 'user', 'assistant' or 'system'
     content = message text
+    pinned = keep this message in the prompt even when history is trimmed
     """
 
-    # Create session if not exists
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = []
-
-    # Append new message
-    chat_sessions[session_id].append({
+    message = {
         "role": role,
         "content": content
-    })
+    }
+    if pinned:
+        message["pinned"] = True
+
+    if CHAT_SHARED_SESSIONS:
+        _write_through(session_id, [message])
+        return
+
+    # Load the session first if it only exists in storage,
+    # otherwise the new message would start a fresh history
+    if session_id not in chat_sessions:
+        get_chat_history(session_id)
+
+    # Append new message (session is created if not exists)
+    chat_sessions.append(session_id, message)
+
+    # Written to disk later by the background flusher
+    flusher.submit(session_id, message)
+
+
+async def asave_turn(session_id: str, user_message: str, reply: str):
+    """
+    Save one user message + assistant reply.
+    With shared sessions both are written in one transaction,
+    in a worker thread.
+    """
+    if not CHAT_SHARED_SESSIONS:
+        if session_id not in chat_sessions:
+            # Evicted since it was read -> load it off the event loop first
+            await anyio.to_thread.run_sync(get_chat_history, session_id, limiter=_io_limiter)
+        save_message(session_id, "user", user_message)
+        save_message(session_id, "assistant", reply)
+        return
+
+    messages = [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": reply},
+    ]
+    await anyio.to_thread.run_sync(_write_through, session_id, messages, limiter=_io_limiter)
+
+
+# -------------------------------
+# Shared sessions (several workers)
+# -------------------------------
+# Messages of shared sessions carry their database row "id". The newest
+# id in memory tells which rows this worker has already seen.
+
+def _last_id(history) -> int:
+    return history[-1]["id"] if history else 0
+
+
+def _sync_shared_history(session_id: str):
+    """
+    Cached history plus anything other workers stored since
+    (one indexed query; usually returns no rows).
+    """
+    history = chat_sessions.get(session_id)
+    new = storage.load_since(session_id, _last_id(history))
+
+    if history is None:
+        return chat_sessions.put(session_id, new) if new else []
+
+    for message in new:
+        chat_sessions.append(session_id, message)
+    return history
+
+
+def _write_through(session_id: str, messages: list):
+    history = chat_sessions.get(session_id)
+    if storage.append_session(session_id, messages, _last_id(history)):
+        for message in messages:
+            chat_sessions.append(session_id, message)
+    else:
+        # Another worker wrote to this session in between
+        # -> reload the whole session on next use
+        chat_sessions.discard(session_id)
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+
+
+class ContextStore:
+    """
+    Remembers the `context` tokens Ollama returned for each session's
+    last turn, so the next turn only sends the new user message and the
+    model does not prefill the whole conversation again.
+
+    Entry per session: (last assistant reply, context tokens, model)
+
+    The saved reply is compared with the newest message in the history
+    before the context is reused. If they differ (history edited,
+    session evicted and recreated, generation failed), the turn goes to
+    another model, or the context grew past max_tokens, get() returns
+    None and the caller falls back to sending the full prompt.
+    """
+
+    def __init__(self, max_sessions: int, max_tokens: int):
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.reused = 0
+        self.fallbacks = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id: str, history: list, model: str = None):
+        """
+        Context tokens to continue from, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                reply, context, context_model = entry
+                last = history[-1] if history else None
+                if (
+                    context_model == model
+                    and last is not None
+                    and last["role"] == "assistant"
+                    and last["content"] == reply
+                    and len(context) <= self.max_tokens
+                ):
+                    self._entries.move_to_end(session_id)
+                    self.reused += 1
+                    return context
+
+                # Stale -> drop it
+                del self._entries[session_id]
+
+            self.fallbacks += 1
+            return None
+
+    def put(self, session_id: str, reply: str, context: list, model: str = None):
+        with self._lock:
+            self._entries[session_id] = (reply, context, model)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def stats(self) -> dict:
+        """
+        Size and reuse counters (for monitoring).
+        """
+        return {
+            "sessions": len(self),
+            "reused": self.reused,
+            "fallbacks": self.fallbacks,
+        }
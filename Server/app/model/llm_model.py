@@ -1,19 +1,121 @@
-from langchain_community.llms import Ollama
+import asyncio
+from contextlib import aclosing
+import httpx
+import json
+import os
 import random
+import re
+import time
+
+from app.model.context_store import ContextStore
+from app.model.model_registry import ModelRegistry
+from app.model.ollama_health import CircuitBreaker
+from app.model.ollama_pool import Backend, BackendPool
+from app.services.metrics import errors, record_cancelled_generation, truncated_replies
+from app.services.scheduler import Overloaded, llm_scheduler
+
+# -------------------------------
+# Ollama settings
+# -------------------------------
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Several Ollama hosts, comma separated (default: just OLLAMA_BASE_URL)
+OLLAMA_BASE_URLS = [
+    url.strip()
+    for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",")
+    if url.strip()
+]
+MODEL_NAME = os.getenv("LLM_MODEL", "phi3:latest")   # ✅ EXACT name from `ollama list`
+# Smaller, faster model for short easy turns, e.g. "qwen2.5:0.5b"
+# (see model_router.py; "" = everything goes to MODEL_NAME)
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "")
+# More models clients may ask for by name (comma separated)
+LLM_EXTRA_MODELS = [name.strip() for name in os.getenv("LLM_EXTRA_MODELS", "").split(",") if name.strip()]
+TEMPERATURE = 0.5                           # Phi likes lower temperature
+
+# Longest reply in tokens; requests may ask for less, never for more
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
+# Context window of the model ("0" = the model's default). Ollama reloads
+# the model when this changes, so requests can only pick a size up to
+# OLLAMA_MAX_NUM_CTX, and mixing sizes on one backend is slow.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0"))
+OLLAMA_MAX_NUM_CTX = int(os.getenv("OLLAMA_MAX_NUM_CTX", "8192"))
+
+# The prompt is a "role: content" transcript, so the model likes to keep
+# going and write the next "user:" turn itself. Ollama stops at these
+# (exact case); the filter below catches any case it misses.
+ROLE_MARKERS = ("\nuser:", "\nassistant:", "\nsystem:", "<|user|>", "<|assistant|>", "<|system|>", "<|end|>")
+STOP_SEQUENCES = list(ROLE_MARKERS) + ["\nUser:", "\nAssistant:", "\nSystem:"]
+
+# Generation options sent with every request
+DEFAULT_OPTIONS = {"temperature": TEMPERATURE, "num_predict": LLM_MAX_TOKENS, "stop": STOP_SEQUENCES}
+if OLLAMA_NUM_CTX:
+    DEFAULT_OPTIONS["num_ctx"] = OLLAMA_NUM_CTX
+
+# How long Ollama keeps the model (and its KV cache) loaded after a request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Which Ollama API the server uses for chat turns:
+#   "generate" - full "role: content" transcript to /api/generate every turn
+#   "chat"     - message list to /api/chat; the prompt prefix stays the same
+#                between turns, so Ollama reuses its KV cache for it
+#   "context"  - /api/generate with the `context` tokens of the last turn,
+#                so only the new user message is sent and prefilled
+LLM_API = os.getenv("LLM_API", "generate")
+
+# "context" mode: sessions whose context is kept, and its max length
+# (longer conversations fall back to the trimmed full prompt)
+OLLAMA_CONTEXT_SESSIONS = int(os.getenv("OLLAMA_CONTEXT_SESSIONS", "1024"))
+OLLAMA_CONTEXT_MAX_TOKENS = int(os.getenv("OLLAMA_CONTEXT_MAX_TOKENS", "3072"))
+
+# Connection pool of each backend's async client (shared by all requests)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "100"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "20"))
+
+# Max generations running on one backend at once
+OLLAMA_BACKEND_CONCURRENCY = int(os.getenv("OLLAMA_BACKEND_CONCURRENCY", "4"))
+# Keep sending a session to the same backend, so its KV cache is reused
+OLLAMA_STICKY_SESSIONS = os.getenv("OLLAMA_STICKY_SESSIONS", "1") == "1"
+
+# Health checks / circuit breaker
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "5"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+OLLAMA_RESET_TIMEOUT = float(os.getenv("OLLAMA_RESET_TIMEOUT", "5"))
+
+# Load the models into memory on startup ("0" to skip)
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") == "1"
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "120"))
 
 # -------------------------------
-# Initialize Phi-3 via Ollama
+# Models and Ollama backends
 # -------------------------------
-try:
-    llm = Ollama(
-        model="phi3:latest",                # ✅ EXACT name from `ollama list`
-        base_url="http://localhost:11434",
-        temperature=0.5,                    # Phi likes lower temperature
+models = ModelRegistry(MODEL_NAME, [LLM_SMALL_MODEL] + LLM_EXTRA_MODELS)
+
+# Whether each backend is reachable is tracked live, not decided once at
+# import: requests skip a backend while its breaker is open, and it closes
+# again as soon as the backend answers (real request or health check).
+ollama_pool = BackendPool(
+    [
+        Backend(
+            url,
+            max_concurrent=OLLAMA_BACKEND_CONCURRENCY,
+            breaker=CircuitBreaker(
+                failure_threshold=OLLAMA_FAILURE_THRESHOLD,
+                reset_timeout=OLLAMA_RESET_TIMEOUT,
+            ),
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive=OLLAMA_MAX_KEEPALIVE,
+            health_interval=OLLAMA_HEALTH_INTERVAL,
+        )
+        for url in OLLAMA_BASE_URLS
+    ],
+    sticky=OLLAMA_STICKY_SESSIONS,
+)
+
+if llm_scheduler.max_concurrent < OLLAMA_BACKEND_CONCURRENCY * len(ollama_pool.backends):
+    print(
+        f"WARNING: LLM_MAX_CONCURRENCY={llm_scheduler.max_concurrent} is below what the "
+        f"{len(ollama_pool.backends)} Ollama backends take, so some of their capacity stays unused"
     )
-    OLLAMA_AVAILABLE = True
-except Exception as e:
-    print(f"Ollama not available: {e}")
-    OLLAMA_AVAILABLE = False
 
 
 # -------------------------------
@@ -26,19 +128,388 @@ MOCK_RESPONSES = [
 ]
 
 
-def generate_response(prompt: str) -> str:
+class ReplyInterrupted(Overloaded):
+    """
+    Raised when the backend failed in the middle of a streamed reply.
+    The part already sent is not a reply: it must not be saved or cached,
+    and the client should retry.
+    """
+
+    status_code = 502
+
+
+def is_fallback(text: str) -> bool:
+    """
+    True if the text is one of the mock replies (not a real model answer).
+    """
+    return text in MOCK_RESPONSES
+
+
+# -------------------------------
+# Generation options
+# -------------------------------
+def generation_options(temperature: float = None, max_tokens: int = None, num_ctx: int = None) -> dict:
+    """
+    Options for one request: DEFAULT_OPTIONS with the request's own
+    settings (max_tokens and num_ctx capped by the server limits).
+    """
+    if temperature is None and max_tokens is None and num_ctx is None:
+        return DEFAULT_OPTIONS
+
+    options = dict(DEFAULT_OPTIONS)
+    if temperature is not None:
+        options["temperature"] = temperature
+    if max_tokens is not None:
+        options["num_predict"] = min(max_tokens, LLM_MAX_TOKENS)
+    if num_ctx is not None:
+        options["num_ctx"] = min(num_ctx, OLLAMA_MAX_NUM_CTX)
+    return options
+
+
+_MARKER_PATTERN = re.compile("|".join(re.escape(m) for m in ROLE_MARKERS), re.IGNORECASE)
+_MARKER_MAX_LEN = max(len(m) for m in ROLE_MARKERS)
+
+
+def truncate_at_role_marker(text: str) -> str:
     """
-    Generate response using Phi3 locally.
+    Cut a reply where the model starts writing another turn itself.
     """
+    match = _MARKER_PATTERN.search(text)
+    if match is None:
+        return text
+    truncated_replies.inc()
+    return text[:match.start()].rstrip()
+
+
+class RoleMarkerFilter:
+    """
+    truncate_at_role_marker for a streamed reply.
+
+    Text that could be the start of a marker (a trailing "\nus") is held
+    back until the next chunk shows whether it is one. Once a marker is
+    found, `stopped` is set and the caller should stop generating.
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        """
+        Next chunk in, text that is safe to send out (may be "").
+        """
+        buffer = self.pending + text
+        match = _MARKER_PATTERN.search(buffer)
+        if match is not None:
+            self.pending = ""
+            self.stopped = True
+            truncated_replies.inc()
+            return buffer[:match.start()].rstrip()
+
+        # Longest tail that a marker could start with
+        hold = 0
+        for size in range(min(len(buffer), _MARKER_MAX_LEN - 1), 0, -1):
+            tail = buffer[-size:].lower()
+            if any(marker.startswith(tail) for marker in ROLE_MARKERS):
+                hold = size
+                break
+
+        self.pending = buffer[len(buffer) - hold:] if hold else ""
+        return buffer[:len(buffer) - hold]
+
+    def flush(self) -> str:
+        """
+        End of the reply: whatever was still held back.
+        """
+        text, self.pending = self.pending, ""
+        return text
+
+
+# -------------------------------
+# Ollama requests (non-blocking)
+# -------------------------------
+# Each backend has one pooled keep-alive client for the whole process.
+# Reusing connections avoids a TCP handshake per request,
+# and awaiting it never blocks the event loop.
+async def close_http_client():
+    """
+    Close the backends' clients (called on app shutdown).
+    """
+    await ollama_pool.close()
+
+
+# -------------------------------
+# Health checks and warm-up
+# -------------------------------
+def start_health_checks():
+    ollama_pool.start_health_checks()
+
+
+async def stop_health_checks():
+    await ollama_pool.stop_health_checks()
+
+
+async def _warm_up_backend(backend: Backend, model: str) -> bool:
     try:
-        if OLLAMA_AVAILABLE:
-            return llm.invoke(prompt)
+        resp = await backend.get_client().post(
+            "/api/generate",
+            json={"model": model, "prompt": "", "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=OLLAMA_WARMUP_TIMEOUT,
+        )
+        resp.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Ollama warm-up of {model} skipped for {backend.url}: {e}")
+        backend.breaker.record_failure()
+        return False
+
+    backend.breaker.record_success()
+    return True
+
+
+async def warm_up() -> bool:
+    """
+    Ask every backend to load the routed models now (an empty prompt only
+    loads it), so the first real user doesn't wait for a model to load.
+    Extra models are loaded on first use. True if at least one backend is ready.
+    """
+    if not OLLAMA_WARMUP:
+        return False
+
+    routed = [name for name in (MODEL_NAME, LLM_SMALL_MODEL) if name]
+    results = await asyncio.gather(*(
+        _warm_up_backend(backend, model) for backend in ollama_pool.backends for model in routed
+    ))
+    return any(results)
+
 
-        # Ollama was not available at import time
-        return random.choice(MOCK_RESPONSES)
+def _generate_payload(prompt: str, stream: bool, options: dict = None, model: str = None) -> dict:
+    return {
+        "model": model or MODEL_NAME,
+        "prompt": prompt,
+        "stream": stream,
+        "options": options or DEFAULT_OPTIONS,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+
+
+def _chat_payload(messages: list, stream: bool, options: dict = None, model: str = None) -> dict:
+    return {
+        "model": model or MODEL_NAME,
+        "messages": messages,
+        "stream": stream,
+        "options": options or DEFAULT_OPTIONS,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+
+
+def _chunk_text(chunk: dict) -> str:
+    # /api/generate sends "response", /api/chat sends "message.content"
+    if "message" in chunk:
+        return chunk["message"].get("content", "")
+    return chunk.get("response", "")
+
+
+def _request_error(backend, e: Exception):
+    """
+    Count a failed request against its backend, unless Ollama turned the
+    request itself down (4xx, e.g. a model this host hasn't pulled): that
+    says nothing about the backend's health.
+    """
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+        print(f"Ollama rejected the request ({backend.url}): {e}")
+        errors.inc("ollama_rejected")
+        if backend.breaker.state == "half_open":
+            # It was the trial request, but it proved nothing -> let another one try
+            backend.breaker.abandon_trial()
+        return
+    print(f"Ollama connection error ({backend.url}): {e}")
+    backend.breaker.record_failure()
+    errors.inc("ollama")
+
+
+async def _astream(path: str, payload: dict, final: dict = None, session_id: str = None):
+    """
+    Stream text chunks from an Ollama endpoint on the least busy backend.
+    The last chunk (with stats / context) is copied into `final` if given.
+
+    If a backend fails (or rejects the request) before sending anything,
+    the request moves on to the next healthy backend; the mock reply is
+    only used when none is left. A failure after the first chunk raises
+    ReplyInterrupted.
+
+    If the caller stops reading (task cancelled, or the generator closed),
+    the upstream request is closed too, which makes Ollama stop generating.
+    The same happens when the model starts writing the next turn itself
+    (see RoleMarkerFilter); the reply ends before the marker.
+    """
+    failed = set()
+    while True:
+        async with ollama_pool.lease(session_id, exclude=failed) as backend:
+            if backend is None:
+                # All backends are known to be down -> don't wait for a connection error
+                yield random.choice(MOCK_RESPONSES)
+                return
+
+            sent_any = False
+            markers = RoleMarkerFilter()
+            start = time.perf_counter()
+            try:
+                async with backend.get_client().stream("POST", path, json=payload) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        text = markers.feed(_chunk_text(chunk))
+                        if text:
+                            sent_any = True
+                            yield text
+                        if markers.stopped:
+                            # Leaving the block closes the connection -> Ollama stops.
+                            # No `final`: its context would end with the made-up turn.
+                            break
+                        if chunk.get("done"):
+                            if final is not None:
+                                final.update(chunk)
+                            break
+                tail = markers.flush()
+                if tail:
+                    yield tail
+                backend.breaker.record_success()
+                return
+
+            except (asyncio.CancelledError, GeneratorExit):
+                record_cancelled_generation(time.perf_counter() - start)
+                raise
+
+            except (httpx.HTTPError, ValueError) as e:
+                _request_error(backend, e)
+                if sent_any:
+                    # Half a reply is already out -> can't retry elsewhere
+                    raise ReplyInterrupted("The reply was cut off, please retry", retry_after=1) from e
+                failed.add(backend)
+
+
+async def agenerate_response(prompt: str, session_id: str = None, options: dict = None, model: str = None) -> str:
+    """
+    Generate a reply using Phi3 (or `model`).
+    Calls Ollama's /api/generate on the least busy backend,
+    trying the next one if it fails.
+    """
+    failed = set()
+    while True:
+        async with ollama_pool.lease(session_id, exclude=failed) as backend:
+            if backend is None:
+                return random.choice(MOCK_RESPONSES)
+
+            start = time.perf_counter()
+            try:
+                resp = await backend.get_client().post(
+                    "/api/generate", json=_generate_payload(prompt, stream=False, options=options, model=model)
+                )
+                resp.raise_for_status()
+                reply = resp.json().get("response", "")
+                backend.breaker.record_success()
+                return truncate_at_role_marker(reply)
+
+            except asyncio.CancelledError:
+                # Closing the connection makes Ollama stop generating
+                record_cancelled_generation(time.perf_counter() - start)
+                raise
+
+            except (httpx.HTTPError, ValueError) as e:
+                _request_error(backend, e)
+                failed.add(backend)
+
+
+async def astream_response(prompt: str, session_id: str = None, options: dict = None, model: str = None):
+    """
+    Stream the reply piece by piece, so the client sees the first token
+    without waiting for the full reply.
+    Ollama streams newline-delimited JSON, one chunk per line.
+    """
+    payload = _generate_payload(prompt, stream=True, options=options, model=model)
+    async with aclosing(_astream("/api/generate", payload, session_id=session_id)) as texts:
+        async for text in texts:
+            yield text
+
+
+# -------------------------------
+# Chat turns (KV-cache friendly)
+# -------------------------------
+session_contexts = ContextStore(
+    max_sessions=OLLAMA_CONTEXT_SESSIONS,
+    max_tokens=OLLAMA_CONTEXT_MAX_TOKENS,
+)
+
+
+def to_chat_messages(history: list, user_message: str) -> list:
+    """
+    History + new message in the /api/chat format.
+    """
+    messages = [{"role": msg["role"], "content": msg["content"]} for msg in history]
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+async def astream_turn(
+    session_id: str, history: list, user_message: str, prompt: str, options: dict = None, model: str = None
+):
+    """
+    Stream the reply to one chat turn using the configured LLM_API.
+
+    history = messages in the prompt (already trimmed to the token budget)
+    prompt  = the same conversation as one "role: content" string
+    options = generation options (default: DEFAULT_OPTIONS)
+    model   = Ollama model (default: MODEL_NAME)
+    """
+    model = models.resolve(model)
+    final = None
+    if LLM_API == "chat":
+        payload = _chat_payload(to_chat_messages(history, user_message), stream=True, options=options, model=model)
+        source = _astream("/api/chat", payload, session_id=session_id)
+
+    elif LLM_API == "context":
+        # Context tokens only mean something to the model that made them
+        context = session_contexts.get(session_id, history, model)
+        if context is not None:
+            # Ollama already has everything before this turn
+            payload = _generate_payload(f"\nuser: {user_message}\nassistant:", stream=True, options=options, model=model)
+            payload["context"] = context
+        else:
+            # First turn, the saved context is gone, or another model -> full prompt
+            payload = _generate_payload(prompt, stream=True, options=options, model=model)
+        final = {}
+        source = _astream("/api/generate", payload, final, session_id)
+
+    else:
+        source = astream_response(prompt, session_id, options, model)
+
+    # aclosing: if our caller stops early, the upstream stream is closed now,
+    # not whenever the generator gets garbage collected
+    parts = []
+    async with aclosing(source) as texts:
+        async for text in texts:
+            parts.append(text)
+            yield text
+
+    if final is not None:
+        if final.get("context"):
+            session_contexts.put(session_id, "".join(parts), final["context"], model)
+        else:
+            session_contexts.drop(session_id)
+
+
+async def agenerate_turn(
+    session_id: str, history: list, user_message: str, prompt: str, options: dict = None, model: str = None
+) -> str:
+    """
+    Non-streaming version of astream_turn.
+    """
+    if LLM_API == "generate":
+        return await agenerate_response(prompt, session_id, options, model)
 
-    except Exception as e:
-        # Most likely Ollama is not running or became unreachable.
-        # Log once per call and return a friendly default message
-        print(f"Ollama connection error, using fallback: {e}")
-        return random.choice(MOCK_RESPONSES)
+    parts = []
+    async for text in astream_turn(session_id, history, user_message, prompt, options, model):
+        parts.append(text)
+    return "".join(parts)
@@ -0,0 +1,24 @@
+class ModelRegistry:
+    """
+    The Ollama models this server may use.
+
+    Requests only put the model name in the payload, so all models share
+    the backends' pooled HTTP clients.
+    """
+
+    def __init__(self, default: str, names: list):
+        self.default = default
+        # Default first, no duplicates or blanks
+        self.names = list(dict.fromkeys(name for name in [default] + list(names) if name))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def resolve(self, name: str = None) -> str:
+        """
+        The model to use: `name` if given, else the default.
+        """
+        return name or self.default
+
+    def stats(self) -> dict:
+        return {"default": self.default, "models": self.names}
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing.
+
+    closed    -> requests go through; `failure_threshold` failures in a row
+                 open the breaker
+    open      -> requests fail fast (no network call) for `reset_timeout`
+                 seconds
+    half_open -> one trial request goes through; success closes the
+                 breaker, failure opens it again
+
+    The health prober reports into the same breaker, so it also closes
+    as soon as the backend answers again. `on_change(state)` is called
+    after every state change (from whichever thread caused it).
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self.failures = 0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.on_change = None
+
+        # Counters
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        """
+        May a request be sent now?
+        """
+        if self.state == "closed":
+            return True
+
+        with self._lock:
+            if time.monotonic() - self._changed_at >= self.reset_timeout:
+                # Let one trial through (again, if the last trial never reported)
+                self._set_state("half_open")
+                return True
+
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        if self.state != "closed" or self.failures:
+            with self._lock:
+                self.failures = 0
+                self._set_state("closed")
+
+    def abandon_trial(self):
+        """
+        The half-open trial request was cancelled before it could report:
+        let the next request be the trial right away.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self._changed_at = time.monotonic() - self.reset_timeout
+        if self.on_change is not None:
+            self.on_change(self.state)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self._set_state("open")
+
+    def stats(self) -> dict:
+        """
+        State and counters (for monitoring).
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+    def _set_state(self, state: str):
+        changed = state != self.state
+        self.state = state
+        self._changed_at = time.monotonic()
+        if changed and self.on_change is not None:
+            self.on_change(state)
+
+
+class HealthProber:
+    """
+    Background task that pings a backend every `interval` seconds
+    and reports the result to its circuit breaker.
+    """
+
+    def __init__(self, client_factory, breaker: CircuitBreaker, interval: float = 5.0, timeout: float = 2.0):
+        self.client_factory = client_factory
+        self.breaker = breaker
+        self.interval = interval
+        self.timeout = timeout
+        self._task = None
+
+    async def probe(self) -> bool:
+        """
+        One health check: Ollama answers GET /api/version when it's up.
+        """
+        try:
+            resp = await self.client_factory().get("/api/version", timeout=self.timeout)
+            resp.raise_for_status()
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            return False
+
+        self.breaker.record_success()
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,224 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import httpx
+
+from app.model.ollama_health import CircuitBreaker, HealthProber
+
+
+class Backend:
+    """
+    One Ollama host: its own pooled HTTP client, circuit breaker,
+    health prober and concurrency cap.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_concurrent: int,
+        breaker: CircuitBreaker,
+        max_connections: int,
+        max_keepalive: int,
+        health_interval: float,
+    ):
+        self.url = url
+        self.max_concurrent = max_concurrent
+        self.breaker = breaker
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+
+        self._client = None
+        self.prober = HealthProber(self.get_client, breaker, interval=health_interval)
+
+        self.outstanding = 0
+        self.requests = 0
+
+    def get_client(self) -> httpx.AsyncClient:
+        """
+        The backend's async HTTP client, created on first use.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                ),
+                # Generations can take a while, but connecting should be fast
+                timeout=httpx.Timeout(300.0, connect=5.0),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "max_concurrent": self.max_concurrent,
+            "requests": self.requests,
+            **self.breaker.stats(),
+        }
+
+
+class BackendPool:
+    """
+    Spreads requests over several Ollama hosts.
+
+    - picks the healthy backend with the fewest outstanding requests
+    - with sticky sessions, a session keeps using the same backend while
+      it's healthy and has room, so Ollama's KV cache for it stays warm
+    - a backend never runs more than its max_concurrent requests; if all
+      healthy backends are full, the request waits for one to free up
+    - backends whose circuit breaker is open are skipped (ejected) until
+      the health prober sees them answer again; a half-open backend only
+      takes its one trial request, nobody waits for it
+
+    Waiters wake up when a request finishes or a breaker changes state,
+    and re-check every recheck_interval seconds in any case.
+    """
+
+    def __init__(
+        self, backends: list, sticky: bool = True, max_sticky_sessions: int = 10000, recheck_interval: float = 1.0
+    ):
+        self.backends = backends
+        self.sticky = sticky
+        self.max_sticky_sessions = max_sticky_sessions
+        self.recheck_interval = recheck_interval
+
+        # session_id -> backend it last used
+        self._affinity = OrderedDict()
+        # Set (and replaced) whenever a backend may have become usable
+        self._changed = None
+        self._loop = None
+        for backend in backends:
+            backend.breaker.on_change = self._breaker_changed
+
+        # Counters
+        self.sticky_hits = 0
+        self.no_backend = 0
+
+    def pick(self, session_id: str = None, exclude=()):
+        """
+        Best backend for a request right now, or None if all are full or down.
+        exclude = backends that already failed this request.
+        """
+        if self.sticky and session_id is not None:
+            backend = self._affinity.get(session_id)
+            if (
+                backend is not None
+                and backend not in exclude
+                and backend.outstanding < backend.max_concurrent
+                and backend.breaker.allow()
+            ):
+                self._affinity.move_to_end(session_id)
+                self.sticky_hits += 1
+                return backend
+
+        for backend in sorted(self.backends, key=lambda b: b.outstanding / b.max_concurrent):
+            if backend in exclude:
+                continue
+            if backend.outstanding < backend.max_concurrent and backend.breaker.allow():
+                if self.sticky and session_id is not None:
+                    self._affinity[session_id] = backend
+                    self._affinity.move_to_end(session_id)
+                    if len(self._affinity) > self.max_sticky_sessions:
+                        self._affinity.popitem(last=False)
+                return backend
+        return None
+
+    def has_healthy(self, exclude=()) -> bool:
+        """
+        Is there a backend worth waiting for? A closed one, or a half-open
+        one that is full (a half-open backend with room that refused us
+        only takes its trial request, so waiting for it could take forever).
+        """
+        return any(
+            backend.breaker.state == "closed"
+            or (backend.breaker.state == "half_open" and backend.outstanding >= backend.max_concurrent)
+            for backend in self.backends
+            if backend not in exclude
+        )
+
+    def _wake(self):
+        if self._changed is not None:
+            changed, self._changed = self._changed, None
+            changed.set()
+
+    def _breaker_changed(self, state: str):
+        # Breakers don't know which thread updates them
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake()
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake)
+
+    @asynccontextmanager
+    async def lease(self, session_id: str = None, exclude=()):
+        """
+        async with pool.lease(session_id) as backend:
+            ... use backend.get_client() ...
+
+        backend is None when every backend (not in exclude) is down.
+        """
+        self._loop = asyncio.get_running_loop()
+        backend = self.pick(session_id, exclude)
+        while backend is None and self.has_healthy(exclude):
+            # Healthy backends exist but all are at their cap -> wait
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.recheck_interval)
+            except asyncio.TimeoutError:
+                pass
+            backend = self.pick(session_id, exclude)
+
+        if backend is None:
+            self.no_backend += 1
+            yield None
+            return
+
+        backend.outstanding += 1
+        try:
+            yield backend
+        except (asyncio.CancelledError, GeneratorExit):
+            # A cancelled half-open trial never reports -> let another one through
+            if backend.breaker.state == "half_open":
+                backend.breaker.abandon_trial()
+            raise
+        finally:
+            backend.outstanding -= 1
+            backend.requests += 1
+            self._wake()
+
+    def start_health_checks(self):
+        for backend in self.backends:
+            backend.prober.start()
+
+    async def stop_health_checks(self):
+        for backend in self.backends:
+            await backend.prober.stop()
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+    def stats(self) -> dict:
+        """
+        Per-backend load and health (for monitoring).
+        """
+        return {
+            "backends": [backend.stats() for backend in self.backends],
+            "sticky_hits": self.sticky_hits,
+            "no_backend": self.no_backend,
+        }
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 # This defines what data the API expects from frontend
 class ChatRequest(BaseModel):
@@ -7,3 +9,18 @@ class ChatRequest(BaseModel):
 
     # user message text
     message: str
+
+    # Optional generation settings (server defaults when left out).
+    # max_tokens and num_ctx are capped by LLM_MAX_TOKENS / OLLAMA_MAX_NUM_CTX.
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    max_tokens: Optional[int] = Field(None, ge=1)
+    num_ctx: Optional[int] = Field(None, ge=256)
+
+    # Model to answer with (one of GET /chat/models "available");
+    # left out, the server picks one by how hard the turn looks
+    model: Optional[str] = None
+
+
+# Many independent chat messages in one request (POST /chat/batch)
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest]
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+# Approximate memory of one message besides its text
+# (the dict itself + the role string)
+MESSAGE_OVERHEAD_BYTES = 300
+
+
+def message_size(msg: dict) -> int:
+    """
+    Approximate resident bytes of one stored message.
+    """
+    return sys.getsizeof(msg["content"]) + MESSAGE_OVERHEAD_BYTES
+
+
+class SessionStore:
+    """
+    In-memory chat sessions with bounded size.
+
+    - max_sessions: keep at most this many sessions
+    - max_bytes: keep the total size of all messages under this
+    - ttl_seconds: drop sessions not used for this long (0 = never)
+
+    Sessions are kept in least-recently-used order, so when a limit is hit
+    the session that was used longest ago is evicted first. Expired
+    sessions are always at the front, so sweeping them is cheap.
+
+    Entry per session: [messages, bytes, last access time]
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, ttl_seconds: float = 0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.resident_bytes = 0
+        self.evicted_lru = 0
+        self.evicted_bytes = 0
+        self.evicted_ttl = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._sessions
+
+    def get(self, session_id: str):
+        """
+        Messages of a session, or None if it does not exist (or expired).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+
+            entry[2] = now
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def append(self, session_id: str, message: dict):
+        """
+        Add a message to a session (created if needed), then enforce limits.
+        """
+        size = message_size(message)
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = [[], 0, now]
+                self._sessions[session_id] = entry
+
+            entry[0].append(message)
+            entry[1] += size
+            entry[2] = now
+            self._sessions.move_to_end(session_id)
+            self.resident_bytes += size
+
+            self._enforce_limits()
+
+    def put(self, session_id: str, messages: list):
+        """
+        Insert a whole session at once (e.g. loaded from storage).
+        An existing session with the same id is kept as is.
+        """
+        size = sum(message_size(msg) for msg in messages)
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = [messages, size, now]
+                self._sessions[session_id] = entry
+                self.resident_bytes += size
+                self._enforce_limits()
+
+            return entry[0]
+
+    def discard(self, session_id: str):
+        """
+        Drop a session from memory (it is loaded again on next use).
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self.resident_bytes -= entry[1]
+
+    def stats(self) -> dict:
+        """
+        Current size and eviction counters (for monitoring).
+        """
+        return {
+            "sessions": len(self._sessions),
+            "resident_bytes": self.resident_bytes,
+            "evicted_lru": self.evicted_lru,
+            "evicted_bytes": self.evicted_bytes,
+            "evicted_ttl": self.evicted_ttl,
+        }
+
+    # -------------------------------
+    # Internal helpers (lock held)
+    # -------------------------------
+    def _evict_oldest(self):
+        _, entry = self._sessions.popitem(last=False)
+        self.resident_bytes -= entry[1]
+
+    def _expire(self, now: float):
+        if not self.ttl_seconds:
+            return
+        deadline = now - self.ttl_seconds
+        while self._sessions:
+            entry = next(iter(self._sessions.values()))
+            if entry[2] > deadline:
+                break
+            self._evict_oldest()
+            self.evicted_ttl += 1
+
+    def _enforce_limits(self):
+        # Never evict the session we just touched (it is last)
+        while len(self._sessions) > self.max_sessions:
+            self._evict_oldest()
+            self.evicted_lru += 1
+        while self.resident_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._evict_oldest()
+            self.evicted_bytes += 1
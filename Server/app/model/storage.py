@@ -0,0 +1,278 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+class StorageBackend:
+    """
+    Durable storage for chat messages.
+
+    The in-memory SessionStore stays the source of truth for hot sessions;
+    a backend only needs to append messages and load a whole session back.
+    """
+
+    def load(self, session_id: str):
+        """
+        All stored messages of a session (oldest first), or None.
+        """
+        return None
+
+    def append_many(self, rows: list):
+        """
+        Store a batch of (session_id, message) rows in order.
+        """
+
+    def load_since(self, session_id: str, after_id: int = 0) -> list:
+        """
+        Messages of a session stored after row `after_id`, each with its
+        row "id" (used to share sessions between worker processes).
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't share sessions between workers")
+
+    def append_session(self, session_id: str, messages: list, expected_last_id: int) -> bool:
+        """
+        Store messages of one session right away and set their "id".
+        False if the session's newest stored row wasn't expected_last_id
+        (another worker added messages the caller hasn't seen).
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't share sessions between workers")
+
+    def load_result(self, session_id: str, key: str, now: float):
+        """
+        (fingerprint, reply) of a finished idempotent turn, or None
+        (none stored, or it expired before `now`, a time.time() value).
+        """
+        return None
+
+    def save_result(self, session_id: str, key: str, fingerprint: str, reply: str, expires_at: float):
+        """
+        Keep a finished idempotent turn until expires_at (time.time()).
+        """
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Stores messages in a SQLite database in WAL mode.
+
+    WAL lets readers load sessions while the flusher writes, and with
+    synchronous=NORMAL a commit does not wait for fsync (a crash of the
+    process loses nothing, a power cut can lose the last few commits).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " pinned INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotent_results ("
+            " session_id TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " reply TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (session_id, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotent_expiry ON idempotent_results (expires_at)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads,
+        # so every thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def load(self, session_id: str):
+        rows = self._connection().execute(
+            "SELECT role, content, pinned FROM messages WHERE session_id = ? ORDER BY id",
+            (session_id,),
+        ).fetchall()
+        if not rows:
+            return None
+
+        messages = []
+        for role, content, pinned in rows:
+            message = {"role": role, "content": content}
+            if pinned:
+                message["pinned"] = True
+            messages.append(message)
+        return messages
+
+    def append_many(self, rows: list):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, pinned, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, msg["role"], msg["content"], int(msg.get("pinned", False)), now)
+                    for session_id, msg in rows
+                ],
+            )
+
+    def load_since(self, session_id: str, after_id: int = 0) -> list:
+        rows = self._connection().execute(
+            "SELECT id, role, content, pinned FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after_id),
+        ).fetchall()
+
+        messages = []
+        for row_id, role, content, pinned in rows:
+            message = {"role": role, "content": content, "id": row_id}
+            if pinned:
+                message["pinned"] = True
+            messages.append(message)
+        return messages
+
+    def append_session(self, session_id: str, messages: list, expected_last_id: int) -> bool:
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            # Take the write lock first, so nobody adds rows between the check and the insert
+            conn.execute("BEGIN IMMEDIATE")
+            last_id = conn.execute(
+                "SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0] or 0
+
+            for msg in messages:
+                cursor = conn.execute(
+                    "INSERT INTO messages (session_id, role, content, pinned, created_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (session_id, msg["role"], msg["content"], int(msg.get("pinned", False)), now),
+                )
+                msg["id"] = cursor.lastrowid
+
+        return last_id == expected_last_id
+
+    def load_result(self, session_id: str, key: str, now: float):
+        row = self._connection().execute(
+            "SELECT fingerprint, reply FROM idempotent_results"
+            " WHERE session_id = ? AND key = ? AND expires_at >= ?",
+            (session_id, key, now),
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def save_result(self, session_id: str, key: str, fingerprint: str, reply: str, expires_at: float):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM idempotent_results WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotent_results (session_id, key, fingerprint, reply, expires_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (session_id, key, fingerprint, reply, expires_at),
+            )
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class WriteBehindFlusher:
+    """
+    Writes messages to a backend from a background thread.
+
+    save_message only puts the message on a queue, so the request never
+    waits for disk. The thread writes whatever piled up in one
+    transaction, at most every `interval` seconds or once `batch_size`
+    messages are waiting.
+    """
+
+    def __init__(self, backend: StorageBackend, batch_size: int = 256, interval: float = 0.05):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.interval = interval
+
+        self._queue = queue.Queue()
+        # session_id -> number of queued messages not written yet
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._idle = threading.Condition(self._pending_lock)
+
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="chat-storage-flusher", daemon=True)
+        self._thread.start()
+
+    def submit(self, session_id: str, message: dict):
+        with self._pending_lock:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put((session_id, message))
+
+    def has_pending(self, session_id: str) -> bool:
+        return session_id in self._pending
+
+    def flush(self, timeout: float = 10.0):
+        """
+        Block until everything queued so far is written.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: not self._pending, timeout=timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+        self.backend.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self.backend.append_many(batch)
+            except Exception as e:
+                # Keep serving from memory; the batch is lost from disk only
+                print(f"Chat storage write failed ({len(batch)} messages): {e}")
+
+            with self._idle:
+                for session_id, _ in batch:
+                    left = self._pending[session_id] - 1
+                    if left:
+                        self._pending[session_id] = left
+                    else:
+                        del self._pending[session_id]
+                self._idle.notify_all()
@@ -1,28 +1,298 @@
-from app.model.chat_memory import get_chat_history, save_message
-from app.model.llm_model import generate_response
+import asyncio
+from contextlib import aclosing
+import os
+import time
 
-def process_chat(session_id: str, user_message: str) -> str:
+import anyio
+
+from app.model.chat_memory import aget_chat_history, asave_turn
+from app.model.llm_model import (
+    DEFAULT_OPTIONS,
+    agenerate_turn,
+    astream_turn,
+    is_fallback,
+    models,
+)
+from app.services.context_window import CHARS_PER_TOKEN, context_window
+from app.services.metrics import (
+    cache_hits,
+    fallback_replies,
+    generation_seconds,
+    history_fetch_seconds,
+    prompt_build_seconds,
+    time_to_first_token_seconds,
+    tokens_per_second,
+)
+from app.services.model_router import model_router
+from app.services.prompt_builder import format_message, prompt_builder
+from app.services.rate_limit import charge_tokens
+from app.services.response_cache import make_key, response_cache
+from app.services.scheduler import LLM_MAX_CONCURRENCY, Overloaded, current_flow, llm_scheduler, session_turns
+from app.services.semantic_cache import SEMANTIC_CACHE_MAX_HISTORY, semantic_cache
+from app.services.tracing import annotate, record_span, span
+
+# Max items in one /chat/batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+# Items of one batch running or waiting for an LLM slot at once.
+# Enough to keep every slot busy, without flooding the LLM queue
+# (which would reject the rest with Overloaded).
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+
+
+async def aprepare_prompt(session_id: str, user_message: str):
+    """
+    History -> token budget -> prompt.
+    Returns (history used, prompt). Cold sessions are loaded in a worker
+    thread first.
+    """
+    with history_fetch_seconds.time(), span("history"):
+        stored = await aget_chat_history(session_id)
+    return _window_and_prompt(session_id, stored, user_message)
+
+
+def _window_and_prompt(session_id: str, stored: list, user_message: str):
+    with prompt_build_seconds.time(), span("prompt"):
+        # Get previous messages that fit in the token budget
+        history = context_window.select(session_id, stored, user_message)
+
+        # Build prompt with history (only new turns get formatted)
+        return history, prompt_builder.build(session_id, history, user_message)
+
+
+def record_generation(start: float, reply: str, model: str):
+    """
+    Generation time, decode speed and fallbacks of one LLM call (per model),
+    and the tokens it used up of the request's rate limit budget.
+    start = time.perf_counter() when the call began.
+    """
+    elapsed = time.perf_counter() - start
+    generation_seconds.observe(elapsed, model)
+    if is_fallback(reply):
+        fallback_replies.inc()
+        return
+
+    tokens = len(reply) / CHARS_PER_TOKEN
+    if elapsed > 0:
+        tokens_per_second.observe(tokens / elapsed, model)
+    # Counts against the request's token budgets (see rate_limit.py)
+    charge_tokens(tokens)
+
+
+# -------------------------------
+# Response caches
+# -------------------------------
+def cache_key(prompt: str, options: dict = None, model: str = None) -> str:
+    """
+    Response cache key for a prompt with the given (or default) model and settings.
+    """
+    return make_key(models.resolve(model), options or DEFAULT_OPTIONS, prompt)
+
+
+def semantic_context(history: list, options: dict = None, model: str = None):
+    """
+    What a semantic match must share besides the meaning of the message.
+    None if the semantic cache is off or the conversation is too long.
+    """
+    if semantic_cache is None or len(history) > SEMANTIC_CACHE_MAX_HISTORY:
+        return None
+    transcript = "".join(format_message(msg) for msg in history)
+    return make_key(models.resolve(model), options or DEFAULT_OPTIONS, transcript)
+
+
+async def afind_cached_reply(history: list, user_message: str, key: str, options: dict = None, model: str = None):
+    """
+    Exact match first, then a similar earlier question. None on miss.
+    The vector search runs in a worker thread (NumPy releases the GIL)
+    so big caches don't stall the event loop.
+    """
+    if response_cache.enabled:
+        reply = await response_cache.aget(key)
+        if reply is not None:
+            cache_hits.inc("exact")
+            return reply
+
+    context = semantic_context(history, options, model)
+    if context is not None:
+        reply = await anyio.to_thread.run_sync(semantic_cache.lookup, context, user_message)
+        if reply is not None:
+            cache_hits.inc("semantic")
+        return reply
+    return None
+
+
+async def aremember_reply(
+    history: list, user_message: str, key: str, reply: str, options: dict = None, model: str = None
+):
+    """
+    Store a fresh model reply in the caches (fallback replies are skipped).
+    """
+    if is_fallback(reply):
+        return
+    if response_cache.enabled:
+        await response_cache.aput(key, reply)
+
+    context = semantic_context(history, options, model)
+    if context is not None:
+        # Worker thread too: insert waits for the lock a running lookup holds
+        await anyio.to_thread.run_sync(semantic_cache.insert, context, user_message, reply)
+
+
+# -------------------------------
+# Async path (used by the API)
+# -------------------------------
+# Hot sessions are a plain in-process dict lookup, so memory access is safe
+# to call directly from the event loop. Cold sessions are first loaded from
+# storage in a worker thread (aget_chat_history), and the LLM call goes
+# through the async HTTP client. LLM calls (not cache hits) need a slot
+# from llm_scheduler, which raises Overloaded when the server is saturated.
+#
+# Each turn (read history -> generate -> save) runs inside
+# session_turns.turn(), so messages of one session never overlap.
+#
+# When the client goes away, the controller cancels the turn (or closes
+# the stream). That aborts the upstream Ollama request, and since the
+# turn is only saved after the whole reply arrived, nothing half-done
+# ends up in the history or the caches.
+
+async def aprocess_chat(session_id: str, user_message: str, options: dict = None, model: str = None) -> str:
     """
     This function connects memory + LLM.
     Controller calls THIS, not model directly.
+    options = generation options (see generation_options), default settings if None
+    model   = model asked for by the client, or None to let model_router pick
+
+    Awaiting the LLM lets other requests run while this one generates.
     """
 
-    # Get previous messages
-    history = get_chat_history(session_id)
+    annotate(session_id=session_id)
+    with span("process_chat"):
+        waited = time.perf_counter()
+        async with session_turns.turn(session_id):
+            record_span("turn_wait", waited)
+            history, prompt = await aprepare_prompt(session_id, user_message)
+            model = model_router.choose(history, user_message, prompt, model)
+            annotate(model=model)
+            key = cache_key(prompt, options, model)
+            with span("cache_lookup"):
+                assistant_reply = await afind_cached_reply(history, user_message, key, options, model)
 
-    # Build prompt with history
-    prompt = ""
-    for msg in history:
-        prompt += f"{msg['role']}: {msg['content']}\n"
+            if assistant_reply is None:
+                waited = time.perf_counter()
+                async with llm_scheduler.slot(current_flow.get()):
+                    start = time.perf_counter()
+                    record_span("queue_wait", waited, start)
+                    with span("generate_response"):
+                        assistant_reply = await agenerate_turn(
+                            session_id, history, user_message, prompt, options, model
+                        )
+                    record_generation(start, assistant_reply, model)
+                await aremember_reply(history, user_message, key, assistant_reply, options, model)
+            else:
+                annotate(cached=True)
 
-    # Add new user message
-    prompt += f"user: {user_message}\nassistant:"
+            await asave_turn(session_id, user_message, assistant_reply)
 
-    # Generate response from LLaMA
-    assistant_reply = generate_response(prompt)
+    return assistant_reply
 
-    # Save both user and assistant messages
-    save_message(session_id, "user", user_message)
-    save_message(session_id, "assistant", assistant_reply)
 
-    return assistant_reply
+async def astream_chat(session_id: str, user_message: str, options: dict = None, model: str = None):
+    """
+    Streaming version of aprocess_chat.
+    Yields the reply chunk by chunk. The full reply is saved
+    to memory only after generation has finished.
+    """
+
+    annotate(session_id=session_id)
+    with span("process_chat"):
+        waited = time.perf_counter()
+        async with session_turns.turn(session_id):
+            record_span("turn_wait", waited)
+            history, prompt = await aprepare_prompt(session_id, user_message)
+            model = model_router.choose(history, user_message, prompt, model)
+            annotate(model=model)
+            key = cache_key(prompt, options, model)
+            with span("cache_lookup"):
+                cached = await afind_cached_reply(history, user_message, key, options, model)
+
+            if cached is not None:
+                annotate(cached=True)
+                yield cached
+                assistant_reply = cached
+            else:
+                parts = []
+                waited = time.perf_counter()
+                async with llm_scheduler.slot(current_flow.get()):
+                    start = time.perf_counter()
+                    record_span("queue_wait", waited, start)
+                    with span("generate_response"):
+                        deltas = astream_turn(session_id, history, user_message, prompt, options, model)
+                        async with aclosing(deltas):
+                            async for delta in deltas:
+                                if not parts:
+                                    first = time.perf_counter()
+                                    time_to_first_token_seconds.observe(first - start, model)
+                                    record_span("first_token", start, first)
+                                parts.append(delta)
+                                yield delta
+
+                assistant_reply = "".join(parts)
+                record_generation(start, assistant_reply, model)
+                await aremember_reply(history, user_message, key, assistant_reply, options, model)
+
+            await asave_turn(session_id, user_message, assistant_reply)
+
+
+# -------------------------------
+# Batches
+# -------------------------------
+async def _batch_item(index: int, session_id: str, message: str, options: dict, model: str) -> dict:
+    result = {"index": index, "session_id": session_id}
+    if model is not None and model not in models:
+        # Same check as check_model() in the controller, but only this item fails
+        result["error"] = f"Unknown model {model!r}, see GET /chat/models"
+        return result
+    try:
+        result["response"] = await aprocess_chat(session_id, message, options, model)
+    except Overloaded as e:
+        result["error"] = str(e)
+        result["retry_after"] = e.retry_after
+    except Exception as e:
+        # One broken item must not fail the whole batch
+        print(f"Batch item {index} failed: {e!r}")
+        result["error"] = "internal error"
+    return result
+
+
+async def aprocess_batch(items: list, options: list = None):
+    """
+    Run many chat messages, yielding one result dict per item as soon
+    as it finishes (not in input order; "index" tells which item it is).
+
+    Messages of the same session run one after another in input order,
+    since each one continues the conversation of the previous one.
+    Different sessions run concurrently, at most BATCH_CONCURRENCY at
+    a time, each through the normal scheduler.
+
+    options = generation options per item (same order as items), or None
+    """
+    sessions = {}
+    for index, item in enumerate(items):
+        item_options = options[index] if options is not None else None
+        sessions.setdefault(item.session_id, []).append((index, item.message, item_options, item.model))
+
+    results = asyncio.Queue()
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_session(session_id: str, turns: list):
+        for index, message, item_options, model in turns:
+            async with limit:
+                results.put_nowait(await _batch_item(index, session_id, message, item_options, model))
+
+    tasks = [asyncio.create_task(run_session(session_id, turns)) for session_id, turns in sessions.items()]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        # Client went away -> stop the rest of the batch
+        for task in tasks:
+            task.cancel()
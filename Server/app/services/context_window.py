@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import os
+
+# Max prompt tokens of history sent to the model (phi3 default context is 4k,
+# so leave room for the reply)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+
+# When the budget is exceeded, trim down to this fraction of it.
+# Trimming in chunks keeps the window start stable for several turns,
+# so the incremental prompt builder can keep appending to its cache.
+CONTEXT_TRIM_RATIO = float(os.getenv("CONTEXT_TRIM_RATIO", "0.75"))
+
+# How many sessions keep their window position (least recently used are dropped)
+CONTEXT_CACHE_SESSIONS = int(os.getenv("CONTEXT_CACHE_SESSIONS", "1024"))
+
+# Rough estimate, good enough for budgeting (~4 characters per token)
+CHARS_PER_TOKEN = 4
+# Extra tokens per message for the "role: " prefix and newline
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_text_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a piece of text.
+    """
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_tokens(msg: dict) -> int:
+    """
+    Token count of one stored message.
+    Counted once and cached on the message itself.
+    """
+    tokens = msg.get("tokens")
+    if tokens is None:
+        tokens = count_text_tokens(msg["content"])
+        msg["tokens"] = tokens
+    return tokens
+
+
+def is_pinned(msg: dict) -> bool:
+    """
+    System turns and explicitly pinned turns are never trimmed.
+    """
+    return msg["role"] == "system" or msg.get("pinned", False)
+
+
+class ContextWindow:
+    """
+    Picks which history messages fit in the token budget.
+
+    The newest turns are kept, older ones are dropped, pinned turns
+    are always kept (and count against the budget).
+
+    Per session we remember where the window starts and which pinned
+    messages lie before it, so each turn only looks at the messages
+    inside the window, not the whole history.
+
+    Cache entry per session:
+    (window start index, pinned messages before the start)
+
+    Histories are append-only (a session reloaded from storage has the
+    same messages), so the start index stays valid; a history that got
+    shorter than it resets the entry.
+    """
+
+    def __init__(
+        self,
+        budget: int = CONTEXT_TOKEN_BUDGET,
+        trim_ratio: float = CONTEXT_TRIM_RATIO,
+        max_sessions: int = CONTEXT_CACHE_SESSIONS,
+    ):
+        self.budget = budget
+        self.trim_ratio = trim_ratio
+        self.max_sessions = max_sessions
+        self._cache = OrderedDict()
+
+    def select(self, session_id: str, history: list, user_message: str = "") -> list:
+        """
+        Return the messages to put in the prompt, oldest first.
+        """
+        start, pinned = self._cache.pop(session_id, (0, []))
+
+        # History got shorter (cleared or replaced) -> start over
+        if start > len(history):
+            start, pinned = 0, []
+
+        pinned_tokens = sum(count_tokens(msg) for msg in pinned)
+        used = pinned_tokens + count_text_tokens(user_message)
+        used += sum(count_tokens(msg) for msg in history[start:])
+
+        if used > self.budget:
+            # Walk back from the newest message until we reach the low-water mark
+            target = self.budget * self.trim_ratio
+            kept = pinned_tokens + count_text_tokens(user_message)
+            new_start = len(history)
+            while new_start > start:
+                msg = history[new_start - 1]
+                if not is_pinned(msg) and kept + count_tokens(msg) > target:
+                    break
+                kept += count_tokens(msg)
+                new_start -= 1
+
+            # Pinned turns that fall out of the window are carried along
+            pinned = pinned + [msg for msg in history[start:new_start] if is_pinned(msg)]
+            start = new_start
+
+        self._cache[session_id] = (start, pinned)
+        if len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+        if pinned:
+            return pinned + history[start:]
+        return history[start:]
+
+
+# Shared context window used by the chat service
+context_window = ContextWindow()
@@ -0,0 +1,259 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+import json
+import os
+import time
+
+import anyio
+
+from app.model.chat_memory import CHAT_SHARED_SESSIONS, storage
+from app.services.metrics import Counter, registry
+from app.services.scheduler import Overloaded
+
+# Seconds a finished reply is kept for clients retrying with the same key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+# Finished replies kept at most (oldest dropped first)
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# Seconds a keyed generation keeps running after its last client left,
+# so a retry arriving right after a timeout can still attach to it
+IDEMPOTENCY_GRACE = float(os.getenv("IDEMPOTENCY_GRACE", "15"))
+
+idempotent_requests = registry.register(Counter(
+    "chat_idempotent_requests_total",
+    "Requests with an idempotency key, by outcome (new, attached, replayed, conflict)",
+    label="outcome",
+))
+
+
+class IdempotencyConflict(Exception):
+    """
+    Raised when a key is reused for a different message.
+    """
+
+    status_code = 422
+
+
+class SharedTurn:
+    """
+    One generation that several requests can follow.
+
+    The generation runs in its own task; every follower gets all chunks
+    from the start, whenever it joined. When the last follower leaves,
+    the generation is cancelled after `grace` seconds unless someone
+    joins again.
+    """
+
+    def __init__(self, fingerprint: str, source, grace: float):
+        self.fingerprint = fingerprint
+        self.grace = grace
+        self.parts = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._changed = asyncio.Event()
+        self._cancel_timer = None
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source):
+        try:
+            async with aclosing(source) as chunks:
+                async for chunk in chunks:
+                    self.parts.append(chunk)
+                    self._wake()
+        except asyncio.CancelledError:
+            # Followers (if any are left) just see a retryable failure
+            self.error = Overloaded("The reply was cancelled, please retry", retry_after=1)
+            raise
+        except Exception as e:
+            # Re-raised in every follower
+            self.error = e
+        finally:
+            self.done = True
+            if self._cancel_timer is not None:
+                self._cancel_timer.cancel()
+            self._wake()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def reply(self) -> str:
+        return "".join(self.parts)
+
+    async def follow(self):
+        """
+        Yield every chunk of the reply, from the first one on.
+        """
+        self.followers += 1
+        if self._cancel_timer is not None:
+            self._cancel_timer.cancel()
+            self._cancel_timer = None
+        try:
+            sent = 0
+            while True:
+                while sent < len(self.parts):
+                    sent += 1
+                    yield self.parts[sent - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done:
+                self._cancel_timer = asyncio.get_running_loop().call_later(self.grace, self.task.cancel)
+
+    def cancel(self):
+        self.task.cancel()
+
+
+class IdempotentTurns:
+    """
+    Chat turns by client-chosen key (Idempotency-Key header on /chat,
+    "idempotency_key" on /ws), so a retried message doesn't generate and save
+    the same turn twice.
+
+    - while a turn runs, requests with its key attach to it
+    - once it finished, its reply is kept for ttl_seconds and replayed
+    - failed or cancelled turns are forgotten, so a retry runs again
+
+    Keys are scoped per session; reusing one for a different message
+    raises IdempotencyConflict.
+
+    Running turns are only known to this process. Finished replies are
+    also kept in `store` if given (the shared SQLite database when
+    several workers share sessions), so a retry that lands on another
+    worker is replayed there too. A retry reaching another worker while
+    the first attempt is still running is not caught.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, grace: float, store=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.grace = grace
+        self.store = store
+        # (session_id, key) -> SharedTurn
+        self._running = {}
+        # (session_id, key) -> (fingerprint, expires_at, reply), oldest first
+        self._finished = OrderedDict()
+
+    @staticmethod
+    def fingerprint(message: str, options: dict = None, model: str = None) -> str:
+        return json.dumps([message, options, model], sort_keys=True, ensure_ascii=False)
+
+    async def stream(self, session_id: str, key: str, message: str, options: dict, start, model: str = None):
+        """
+        Chunks of the reply for this key. `start()` returns the async
+        iterator of chunks and is only called if no turn with this key
+        is running or finished.
+        """
+        scope = (session_id, key)
+        fingerprint = self.fingerprint(message, options, model)
+
+        finished = self._get_finished(scope)
+        if finished is None and self.store is not None and self.ttl_seconds > 0:
+            # Maybe another worker finished it
+            stored = await anyio.to_thread.run_sync(self.store.load_result, session_id, key, time.time())
+            if stored is not None:
+                finished = (stored[0], None, stored[1])
+        if finished is not None:
+            self._check(finished[0], fingerprint)
+            idempotent_requests.inc("replayed")
+            yield finished[2]
+            return
+
+        turn = self._running.get(scope)
+        if turn is not None:
+            self._check(turn.fingerprint, fingerprint)
+            idempotent_requests.inc("attached")
+        else:
+            idempotent_requests.inc("new")
+            source = start()
+            if self.store is not None and self.ttl_seconds > 0:
+                source = self._stored(source, session_id, key, fingerprint)
+            turn = self._running[scope] = SharedTurn(fingerprint, source, self.grace)
+            turn.task.add_done_callback(lambda task: self._finish(scope, turn))
+
+        async with aclosing(turn.follow()) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def run(self, session_id: str, key: str, message: str, options: dict, start, model: str = None) -> str:
+        """
+        Non-streaming stream(): the whole reply. `start()` returns an
+        awaitable of the reply.
+        """
+        async def once():
+            yield await start()
+
+        parts = []
+        async with aclosing(self.stream(session_id, key, message, options, once, model)) as chunks:
+            async for chunk in chunks:
+                parts.append(chunk)
+        return "".join(parts)
+
+    async def _stored(self, source, session_id: str, key: str, fingerprint: str):
+        """
+        Pass the chunks through; once the reply is complete, save it to
+        the store before the turn counts as finished.
+        """
+        parts = []
+        async with aclosing(source) as chunks:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        await anyio.to_thread.run_sync(
+            self.store.save_result, session_id, key, fingerprint, "".join(parts), time.time() + self.ttl_seconds
+        )
+
+    def cancel(self, session_id: str, key: str) -> bool:
+        """
+        Stop a running turn right away (no grace period).
+        """
+        turn = self._running.get((session_id, key))
+        if turn is None:
+            return False
+        turn.cancel()
+        return True
+
+    def stats(self) -> dict:
+        return {"running": len(self._running), "finished": len(self._finished)}
+
+    def _check(self, expected: str, fingerprint: str):
+        if expected != fingerprint:
+            idempotent_requests.inc("conflict")
+            raise IdempotencyConflict("Idempotency key was already used for a different message")
+
+    def _get_finished(self, scope):
+        entry = self._finished.get(scope)
+        if entry is not None and entry[1] < time.monotonic():
+            del self._finished[scope]
+            return None
+        return entry
+
+    def _finish(self, scope, turn: SharedTurn):
+        if self._running.get(scope) is turn:
+            del self._running[scope]
+        if turn.error is not None or self.ttl_seconds <= 0:
+            return
+
+        now = time.monotonic()
+        self._finished[scope] = (turn.fingerprint, now + self.ttl_seconds, turn.reply())
+        self._finished.move_to_end(scope)
+        # Same TTL for all, so the oldest entries expire first
+        while self._finished:
+            oldest = next(iter(self._finished.values()))
+            if len(self._finished) <= self.max_entries and oldest[1] >= now:
+                break
+            self._finished.popitem(last=False)
+
+
+idempotent_turns = IdempotentTurns(
+    ttl_seconds=IDEMPOTENCY_TTL,
+    max_entries=IDEMPOTENCY_MAX_KEYS,
+    grace=IDEMPOTENCY_GRACE,
+    # Finished replies are shared through the database when sessions are
+    store=storage if CHAT_SHARED_SESSIONS else None,
+)
@@ -0,0 +1,287 @@
+from bisect import bisect_left
+import time
+
+# Prometheus text format, hand-rolled so the hot path stays a few integer
+# additions: no locks, no label parsing, no allocations per observation.
+# Metrics are updated from the event loop; an update from a worker thread
+# may in rare cases lose an increment, which is fine for monitoring.
+
+# Default latency buckets in seconds (5 ms .. 2 min)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Decode speed buckets in tokens per second
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Value that only goes up. With `label`, one value per label value:
+
+        cache_hits = Counter("chat_cache_hits_total", "...", label="cache")
+        cache_hits.inc("exact")
+
+    Or read from `callback` when /metrics is scraped, for counts another
+    object keeps anyway (with `label`, the callback returns a dict).
+    """
+
+    def __init__(self, name: str, help: str, label: str = None, callback=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.callback = callback
+        self._values = {}
+
+    def inc(self, label_value: str = None, amount: float = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value: str = None):
+        return self._current().get(label_value, 0)
+
+    def values(self) -> dict:
+        """
+        All values by label value.
+        """
+        return dict(self._current())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        values = self._current()
+        if self.label is None:
+            lines.append(f"{self.name} {_format_value(values.get(None, 0))}")
+        else:
+            for label_value, value in sorted(values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {_format_value(value)}')
+        return lines
+
+    def _current(self) -> dict:
+        if self.callback is None:
+            return self._values
+        value = self.callback()
+        return value if self.label is not None else {None: value}
+
+
+class Gauge:
+    """
+    Value that goes up and down. Either set with inc()/dec(), or read
+    from `callback` when /metrics is scraped (zero cost in between).
+    """
+
+    def __init__(self, name: str, help: str, callback=None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self._value = 0
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    def value(self):
+        return self.callback() if self.callback is not None else self._value
+
+    def render(self) -> list:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self.value())}",
+        ]
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets.
+    observe() is a binary search and two additions.
+
+    With `label`, one distribution per label value:
+
+        generation_seconds.observe(1.7, "phi3:latest")
+    """
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, label: str = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        # label value -> _Series
+        self._series = {}
+
+    def observe(self, value: float, label_value: str = None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = _Series(len(self.buckets))
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def time(self):
+        """
+        with histogram.time():
+            ... measured code ...
+        """
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(sum(series.counts) for series in self._series.values())
+
+    def mean(self) -> float:
+        count = self.count
+        return sum(series.sum for series in self._series.values()) / count if count else 0.0
+
+    def summary(self) -> dict:
+        """
+        Count and mean per label value (e.g. for a JSON status endpoint).
+        """
+        result = {}
+        for label_value, series in self._series.items():
+            count = sum(series.counts)
+            result[label_value] = {"count": count, "mean": series.sum / count if count else 0.0}
+        return result
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        if self.label is None:
+            self._render_series(lines, self._series.get(None) or _Series(len(self.buckets)), "")
+        else:
+            for label_value, series in sorted(self._series.items()):
+                self._render_series(lines, series, f'{self.label}="{label_value}"')
+        return lines
+
+    def _render_series(self, lines: list, series, labels: str):
+        prefix = labels + "," if labels else ""
+        suffix = "{" + labels + "}" if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, series.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{{prefix}le="{_format_value(float(bound))}"}} {cumulative}')
+        cumulative += series.counts[-1]
+        lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum{suffix} {_format_value(series.sum)}")
+        lines.append(f"{self.name}_count{suffix} {cumulative}")
+
+
+class _Series:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, buckets: int):
+        # One count per bucket, plus the +Inf bucket
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """
+    All metrics of the process, rendered together for /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# -------------------------------
+# Chat pipeline stages
+# -------------------------------
+history_fetch_seconds = registry.register(Histogram(
+    "chat_history_fetch_seconds", "Time to load a session's history (memory or storage)",
+))
+prompt_build_seconds = registry.register(Histogram(
+    "chat_prompt_build_seconds", "Time to trim the history and build the prompt",
+))
+time_to_first_token_seconds = registry.register(Histogram(
+    "chat_time_to_first_token_seconds", "Time from starting generation to the first streamed chunk",
+    label="model",
+))
+generation_seconds = registry.register(Histogram(
+    "chat_generation_seconds", "Total time of one LLM generation", label="model",
+))
+tokens_per_second = registry.register(Histogram(
+    "chat_tokens_per_second", "Generated tokens per second (estimated from reply length)",
+    buckets=RATE_BUCKETS, label="model",
+))
+
+# -------------------------------
+# Counters
+# -------------------------------
+fallback_replies = registry.register(Counter(
+    "chat_fallback_replies_total", "Mock replies sent because no Ollama backend answered",
+))
+cache_hits = registry.register(Counter(
+    "chat_cache_hits_total", "Replies served from a response cache", label="cache",
+))
+model_routes = registry.register(Counter(
+    "chat_model_routes_total", "Why a turn went to the model it did", label="reason",
+))
+errors = registry.register(Counter(
+    "chat_errors_total", "Failed requests and backend errors", label="type",
+))
+cancelled_generations = registry.register(Counter(
+    "chat_cancelled_generations_total", "Generations aborted because nobody would read the reply",
+))
+reclaimed_generation_seconds = registry.register(Counter(
+    "chat_reclaimed_generation_seconds_total",
+    "Estimated model time saved by aborting generations (mean generation time minus time already spent)",
+))
+truncated_replies = registry.register(Counter(
+    "chat_truncated_replies_total", "Replies cut where the model started writing the next turn itself",
+))
+
+# -------------------------------
+# Gauges
+# -------------------------------
+websocket_connections = registry.register(Gauge(
+    "chat_websocket_connections", "Open WebSocket connections",
+))
+
+
+def record_cancelled_generation(elapsed: float):
+    """
+    A generation was aborted after `elapsed` seconds.
+    """
+    cancelled_generations.inc()
+    reclaimed_generation_seconds.inc(amount=max(0.0, generation_seconds.mean() - elapsed))
+
+
+def register_gauge(name: str, help: str, callback) -> Gauge:
+    """
+    Gauge read from `callback` at scrape time.
+    """
+    return registry.register(Gauge(name, help, callback=callback))
+
+
+def register_counter(name: str, help: str, callback, label: str = None) -> Counter:
+    """
+    Counter read from `callback` at scrape time.
+    """
+    return registry.register(Counter(name, help, label=label, callback=callback))
@@ -0,0 +1,90 @@
+import os
+import re
+
+from app.model.llm_model import LLM_SMALL_MODEL, models
+from app.services.context_window import CHARS_PER_TOKEN
+from app.services.metrics import generation_seconds, model_routes, time_to_first_token_seconds
+
+# A turn goes to LLM_SMALL_MODEL only if all of these hold
+# (tune them with GET /chat/models and the per-model latency metrics):
+# the new message is at most this many characters
+ROUTER_SMALL_MAX_MESSAGE_CHARS = int(os.getenv("ROUTER_SMALL_MAX_MESSAGE_CHARS", "280"))
+# the conversation so far has at most this many messages
+ROUTER_SMALL_MAX_HISTORY = int(os.getenv("ROUTER_SMALL_MAX_HISTORY", "6"))
+# the whole prompt is at most this many tokens (estimated)
+ROUTER_SMALL_MAX_PROMPT_TOKENS = int(os.getenv("ROUTER_SMALL_MAX_PROMPT_TOKENS", "1024"))
+
+# Cheap classifier: cues that a message asks for reasoning, code or
+# long-form writing, which the small model does badly
+HARD_CUES = re.compile(
+    r"```|\b(explain|why|how (do|does|can|to)|compare|analy[sz]e|prove|derive|calculate|solve"
+    r"|step by step|write (a|an|the|me)|code|function|debug|error|translate|summari[sz]e)\b"
+    r"|\d\s*[-+*/^=]\s*\d",
+    re.IGNORECASE,
+)
+
+
+class ModelRouter:
+    """
+    Picks the model for a chat turn: short chit-chat goes to the small
+    model, anything long or hard-looking to the default one. A model
+    asked for by the client always wins.
+    """
+
+    def __init__(self, default: str, small: str, max_message_chars: int, max_history: int, max_prompt_tokens: int):
+        self.default = default
+        self.small = small
+        self.max_message_chars = max_message_chars
+        self.max_history = max_history
+        self.max_prompt_tokens = max_prompt_tokens
+
+    def choose(self, history: list, user_message: str, prompt: str, requested: str = None) -> str:
+        model, reason = self._choose(history, user_message, prompt, requested)
+        model_routes.inc(reason)
+        return model
+
+    def _choose(self, history: list, user_message: str, prompt: str, requested: str = None):
+        if requested:
+            return requested, "requested"
+        if not self.small:
+            return self.default, "default"
+        if len(user_message) > self.max_message_chars:
+            return self.default, "long_message"
+        if len(history) > self.max_history:
+            return self.default, "long_history"
+        if len(prompt) / CHARS_PER_TOKEN > self.max_prompt_tokens:
+            return self.default, "long_prompt"
+        if HARD_CUES.search(user_message):
+            return self.default, "hard"
+        return self.small, "small"
+
+    def stats(self) -> dict:
+        """
+        Settings plus latency per model, for tuning the thresholds.
+        """
+        latency = {}
+        for name, summary in generation_seconds.summary().items():
+            latency[name] = {"generations": summary["count"], "mean_seconds": round(summary["mean"], 3)}
+        for name, summary in time_to_first_token_seconds.summary().items():
+            latency.setdefault(name, {})["mean_first_token_seconds"] = round(summary["mean"], 3)
+        return {
+            "default": self.default,
+            "small": self.small or None,
+            "available": models.names,
+            "thresholds": {
+                "max_message_chars": self.max_message_chars,
+                "max_history": self.max_history,
+                "max_prompt_tokens": self.max_prompt_tokens,
+            },
+            "routes": model_routes.values(),
+            "latency": latency,
+        }
+
+
+model_router = ModelRouter(
+    default=models.default,
+    small=LLM_SMALL_MODEL,
+    max_message_chars=ROUTER_SMALL_MAX_MESSAGE_CHARS,
+    max_history=ROUTER_SMALL_MAX_HISTORY,
+    max_prompt_tokens=ROUTER_SMALL_MAX_PROMPT_TOKENS,
+)
@@ -0,0 +1,113 @@
+from collections import Counter
+import os
+import sys
+import threading
+
+# Seconds between two stack samples
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+# Deepest stack kept per sample (innermost frames)
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", "64"))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that can be switched on and off while the
+    server runs.
+
+    A background thread wakes up every `interval` seconds and records
+    the current stack of every other thread. The code never runs
+    instrumented, so the cost is only the sampling thread (and zero
+    while stopped).
+
+    report() gives "collapsed stacks" (frame;frame;frame count), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL, max_depth: int = PROFILER_MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = None, reset: bool = True) -> bool:
+        """
+        Start sampling. False if it was already running.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval is not None:
+                self.interval = interval
+            if reset:
+                self.samples.clear()
+                self.sample_count = 0
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> bool:
+        """
+        Stop sampling (samples are kept for report()). False if it wasn't running.
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return False
+            self._stop.set()
+            self._thread = None
+        thread.join()
+        return True
+
+    def report(self, limit: int = None) -> str:
+        """
+        Collapsed stacks, most sampled first.
+        """
+        with self._lock:
+            top = self.samples.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in top)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "distinct_stacks": len(self.samples),
+        }
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    self.samples[self._collapse(names, thread_id, frame)] += 1
+                self.sample_count += 1
+
+    def _collapse(self, names: dict, thread_id: int, frame) -> str:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+
+        name = names.get(thread_id)
+        if name is None:
+            name = next((t.name for t in threading.enumerate() if t.ident == thread_id), str(thread_id))
+            names[thread_id] = name
+        stack.append(name)
+        return ";".join(reversed(stack))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import os
+
+# How many sessions keep a cached transcript (least recently used are dropped)
+PROMPT_CACHE_SESSIONS = int(os.getenv("PROMPT_CACHE_SESSIONS", "1024"))
+
+
+def format_message(msg: dict) -> str:
+    """
+    One history line of the prompt.
+    """
+    return f"{msg['role']}: {msg['content']}\n"
+
+
+def build_prompt(history: list, user_message: str) -> str:
+    """
+    Turn the history + new user message into one prompt string.
+    Stateless version of PromptBuilder.build (formats everything every time).
+    """
+    transcript = "".join(format_message(msg) for msg in history)
+
+    # Add new user message
+    return transcript + f"user: {user_message}\nassistant:"
+
+
+class PromptBuilder:
+    """
+    Builds prompts incrementally, one cached transcript per session.
+
+    Instead of formatting the whole history on every turn, we remember
+    the transcript we built last time and only format the messages
+    appended since then.
+
+    Cache entry per session:
+    (number of messages formatted, last message formatted, transcript text)
+
+    The last message is kept to detect when the history was changed
+    some other way than appending (trimmed, replaced, cleared). In that
+    case the entry is thrown away and the transcript is rebuilt.
+    """
+
+    def __init__(self, max_sessions: int = PROMPT_CACHE_SESSIONS):
+        self.max_sessions = max_sessions
+        self._cache = OrderedDict()
+
+    def transcript(self, session_id: str, history: list) -> str:
+        """
+        Return the formatted history for a session.
+        """
+        # pop() (not get()) so `text` has no other reference and
+        # CPython can extend it in place instead of copying it
+        count, last_msg, text = self._cache.pop(session_id, (0, None, ""))
+
+        # History was rewritten (not just appended) -> start over
+        if count > len(history) or (count and history[count - 1] is not last_msg):
+            count, text = 0, ""
+
+        if count < len(history):
+            text += "".join(format_message(msg) for msg in history[count:])
+            count = len(history)
+
+        self._cache[session_id] = (count, history[-1] if history else None, text)
+        if len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+        return text
+
+    def build(self, session_id: str, history: list, user_message: str) -> str:
+        """
+        Full prompt: cached transcript + new user message.
+        """
+        return self.transcript(session_id, history) + f"user: {user_message}\nassistant:"
+
+
+# Shared builder used by the chat service
+prompt_builder = PromptBuilder()
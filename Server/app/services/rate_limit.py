@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+import math
+import os
+import time
+
+from app.services.metrics import Counter, registry
+from app.services.scheduler import Overloaded
+
+# Token buckets: "<per minute>" refill rate and a burst size each, 0 = no limit.
+# Requests: chat messages started per session / per client address.
+SESSION_RATE_LIMIT = float(os.getenv("SESSION_RATE_LIMIT", "60"))
+SESSION_RATE_BURST = float(os.getenv("SESSION_RATE_BURST", "10"))
+CLIENT_RATE_LIMIT = float(os.getenv("CLIENT_RATE_LIMIT", "0"))
+CLIENT_RATE_BURST = float(os.getenv("CLIENT_RATE_BURST", "30"))
+# Tokens: model output per session / per client address; a request is let in
+# while the budget is positive and its reply is charged when it's done.
+SESSION_TOKEN_LIMIT = float(os.getenv("SESSION_TOKEN_LIMIT", "0"))
+CLIENT_TOKEN_LIMIT = float(os.getenv("CLIENT_TOKEN_LIMIT", "0"))
+# Buckets kept per limit at most. Idle buckets are dropped anyway once
+# they are full again, since a full bucket is the same as a new one.
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+rate_limited = registry.register(Counter(
+    "chat_rate_limited_total", "Requests rejected by a rate limit", label="limit",
+))
+
+
+class RateLimited(Overloaded):
+    """
+    Raised when a session or client is over one of its limits.
+    """
+
+    status_code = 429
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class Limit:
+    """
+    One token bucket per key, refilled at `per_minute` up to `burst`.
+    Buckets are refilled lazily when touched, so there is no timer.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: float, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # key -> TokenBucket, least recently used first
+        self._buckets = OrderedDict()
+
+    def bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            self._evict(now)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def wait_time(self, bucket: TokenBucket, cost: float) -> float:
+        """
+        Seconds until the bucket holds `cost` tokens.
+        """
+        missing = cost - bucket.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float):
+        # A couple per new bucket keeps this O(1) and still drains idle ones
+        for _ in range(2):
+            if len(self._buckets) == 1:
+                # Only the new bucket is left
+                return
+            key, oldest = next(iter(self._buckets.items()))
+            full = oldest.tokens + (now - oldest.updated) * self.rate >= self.burst
+            if not full and len(self._buckets) <= self.max_buckets:
+                return
+            del self._buckets[key]
+
+
+# (limit, key) of the token budgets the running request is charged to
+_charged: ContextVar = ContextVar("rate_limit_charged", default=())
+
+
+class RateLimiter:
+    """
+    Request and token limits per session id and per client address,
+    checked before a chat message gets anywhere near the LLM queue.
+    """
+
+    def __init__(self, session_requests: Limit = None, client_requests: Limit = None,
+                 session_tokens: Limit = None, client_tokens: Limit = None):
+        self.session_requests = session_requests
+        self.client_requests = client_requests
+        self.session_tokens = session_tokens
+        self.client_tokens = client_tokens
+
+    def admit(self, session_id: str, client: str = None):
+        """
+        Count one request, or raise RateLimited (nothing is counted then).
+        The token budgets are remembered for charge_tokens().
+        """
+        now = time.monotonic()
+        checks = []
+        for limit, key, cost, who in (
+            (self.session_requests, session_id, 1, "session"),
+            (self.client_requests, client, 1, "client"),
+            # Token budgets only need to be positive (the reply's size isn't known yet)
+            (self.session_tokens, session_id, 0, "session"),
+            (self.client_tokens, client, 0, "client"),
+        ):
+            if limit is None or not key:
+                continue
+            bucket = limit.bucket(key, now)
+            wait = limit.wait_time(bucket, cost)
+            if wait > 0:
+                rate_limited.inc(limit.name)
+                raise RateLimited(f"Rate limit exceeded for this {who}", max(1, math.ceil(wait)))
+            checks.append((limit, key, bucket, cost))
+
+        for _, _, bucket, cost in checks:
+            bucket.tokens -= cost
+        _charged.set(tuple(
+            (limit, key) for limit, key, _, _ in checks
+            if limit is self.session_tokens or limit is self.client_tokens
+        ))
+
+    def stats(self) -> dict:
+        limits = (self.session_requests, self.client_requests, self.session_tokens, self.client_tokens)
+        return {limit.name: len(limit) for limit in limits if limit is not None}
+
+
+def charge_tokens(tokens: float):
+    """
+    Take a finished reply's tokens from the budgets of the current
+    request (no-op outside a rate-limited request). Budgets may go
+    negative, which blocks the next request until they refill.
+    """
+    now = time.monotonic()
+    for limit, key in _charged.get():
+        limit.bucket(key, now).tokens -= tokens
+
+
+def _limit(name: str, per_minute: float, burst: float):
+    return Limit(name, per_minute, burst) if per_minute > 0 else None
+
+
+rate_limiter = RateLimiter(
+    session_requests=_limit("session_requests", SESSION_RATE_LIMIT, SESSION_RATE_BURST),
+    client_requests=_limit("client_requests", CLIENT_RATE_LIMIT, CLIENT_RATE_BURST),
+    # A minute's worth of tokens can be spent at once
+    session_tokens=_limit("session_tokens", SESSION_TOKEN_LIMIT, SESSION_TOKEN_LIMIT),
+    client_tokens=_limit("client_tokens", CLIENT_TOKEN_LIMIT, CLIENT_TOKEN_LIMIT),
+)
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import anyio
+
+# Max replies kept in memory (0 disables the cache)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Seconds a cached reply stays valid (0 = forever)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0"))
+# SQLite file for replies evicted from memory ("" = no spill to disk)
+RESPONSE_CACHE_SPILL_PATH = os.getenv("RESPONSE_CACHE_SPILL_PATH", "")
+
+
+def make_key(model: str, options: dict, prompt: str) -> str:
+    """
+    Cache key: model + generation options + hash of the final prompt.
+    """
+    raw = json.dumps([model, options, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskSpill:
+    """
+    Replies pushed out of the memory cache, kept in a SQLite file.
+    It's only a cache, so writes are not synced to disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at and expires_at < time.time():
+            return None
+        return value
+
+    def put_many(self, items: list):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                items,
+            )
+
+
+class ResponseCache:
+    """
+    Exact-match cache of model replies.
+
+    Keeps up to max_entries replies in least-recently-used order.
+    Replies evicted from memory are spilled to disk (if configured) and
+    promoted back on the next hit.
+
+    Entry: key -> (reply, expires_at)   expires_at = 0 means no expiry
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float = 0, spill_path: str = ""):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.spill = DiskSpill(spill_path) if spill_path else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def aget(self, key: str):
+        """
+        Cached reply or None. Checks memory, then the disk spill
+        (in a worker thread).
+        """
+        value = self._get_memory(key)
+        if value is None and self.spill is not None:
+            value = await anyio.to_thread.run_sync(self._get_disk, key)
+        if value is None:
+            self.misses += 1
+        return value
+
+    async def aput(self, key: str, value: str):
+        """
+        Store a reply. Spilling evicted replies runs in a worker thread.
+        """
+        evicted = self._put_memory(key, value)
+        if evicted and self.spill is not None:
+            await anyio.to_thread.run_sync(self.spill.put_many, evicted)
+
+    def stats(self) -> dict:
+        """
+        Size and hit/miss counters (for monitoring).
+        """
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    # -------------------------------
+    # Internal helpers
+    # -------------------------------
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at and expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _get_disk(self, key: str):
+        value = self.spill.get(key)
+        if value is not None:
+            self.disk_hits += 1
+            # Promote back to memory (already in a worker thread)
+            evicted = self._put_memory(key, value)
+            if evicted:
+                self.spill.put_many(evicted)
+        return value
+
+    def _put_memory(self, key: str, value: str) -> list:
+        """
+        Store in memory; returns the evicted (key, value, expires_at) rows.
+        """
+        if not self.enabled:
+            return []
+
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else 0
+        evicted = []
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_value, old_expires) = self._entries.popitem(last=False)
+                evicted.append((old_key, old_value, old_expires))
+                self.evictions += 1
+        return evicted
+
+
+# Shared cache used by the chat service
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl_seconds=RESPONSE_CACHE_TTL,
+    spill_path=RESPONSE_CACHE_SPILL_PATH,
+)
@@ -0,0 +1,274 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import math
+import os
+import time
+
+from app.services.metrics import errors
+
+# How many generations may run on Ollama at once. Default: what the
+# backend pool takes, OLLAMA_BACKEND_CONCURRENCY per host in
+# OLLAMA_BASE_URLS (read here, since llm_model.py imports this module).
+_OLLAMA_HOSTS = [
+    url for url in os.getenv("OLLAMA_BASE_URLS", os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).split(",")
+    if url.strip()
+]
+LLM_MAX_CONCURRENCY = int(os.getenv(
+    "LLM_MAX_CONCURRENCY",
+    str(len(_OLLAMA_HOSTS) * int(os.getenv("OLLAMA_BACKEND_CONCURRENCY", "4"))),
+))
+# How many requests may wait for a free slot (more are rejected right away)
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+# Seconds a request may wait in the queue before it is rejected
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Max messages of one session running or waiting for their turn
+SESSION_MAX_PENDING = int(os.getenv("SESSION_MAX_PENDING", "8"))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request can't get an LLM slot.
+    retry_after = suggested seconds before trying again.
+    """
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SessionBusy(Overloaded):
+    """
+    Raised when one session has too many messages waiting.
+    The client is sending too fast, so this is a 429, not a 503.
+    """
+
+    status_code = 429
+
+
+class AdmissionController:
+    """
+    Limits concurrent LLM calls and queues the rest.
+
+    - up to max_concurrent requests run at once
+    - up to max_queue requests wait for a slot
+    - anything beyond that, or waiting longer than queue_timeout,
+      fails fast with Overloaded instead of slowing everyone down
+
+    Waiting requests are grouped by flow (the client address, see
+    current_flow). A freed slot goes to the next flow in round-robin
+    order, first come first served within a flow, so one busy client
+    (e.g. a batch job over many sessions) can't starve the others.
+    Flows are coarser than sessions on purpose: SessionTurns already
+    lets only one message per session in here, so per-session flows
+    would each hold a single waiter and the order would be plain FIFO.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        # flow -> deque of waiting futures, in round-robin order
+        self._flows = OrderedDict()
+        self._queued = 0
+
+        # Average seconds a slot is held (moving average), for Retry-After
+        self._avg_service = 1.0
+
+        # Counters
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        """
+        Rough seconds until a queued request would get a slot.
+        """
+        rounds = (self._queued + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._avg_service))
+
+    async def acquire(self, flow=None):
+        """
+        Wait for a free slot. Raises Overloaded if the queue is full
+        or the wait takes longer than queue_timeout.
+        """
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self._record_wait(0.0)
+            return
+
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            errors.inc("queue_full")
+            raise Overloaded("Server is busy, too many requests waiting", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = self._flows.get(flow)
+        if waiters is None:
+            waiters = self._flows[flow] = deque()
+        waiters.append(waiter)
+        self._queued += 1
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed to us just as we gave up -> pass it on
+                self.release()
+            else:
+                self._remove_waiter(flow, waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                errors.inc("queue_timeout")
+                raise Overloaded("Server is busy, timed out waiting in queue", self.retry_after()) from None
+            raise
+
+        # release() handed its slot over to us (_active unchanged)
+        self._record_wait(time.monotonic() - start)
+
+    def release(self):
+        """
+        Free a slot, handing it straight to the next flow's oldest waiter.
+        """
+        while self._flows:
+            flow, waiters = self._flows.popitem(last=False)
+            waiter = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                # Flow still has work -> back of the round-robin line
+                self._flows[flow] = waiters
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, flow=None):
+        """
+        async with scheduler.slot(current_flow.get()):
+            ... call the LLM ...
+        """
+        await self.acquire(flow)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._avg_service = 0.9 * self._avg_service + 0.1 * (time.monotonic() - start)
+            self.release()
+
+    def stats(self) -> dict:
+        """
+        Queue depth, wait times and counters (for monitoring).
+        """
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "queued_flows": len(self._flows),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": self.wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            "max_wait_ms": self.wait_max * 1000,
+        }
+
+    def _remove_waiter(self, flow, waiter):
+        waiters = self._flows.get(flow)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._queued -= 1
+        if not waiters:
+            del self._flows[flow]
+
+    def _record_wait(self, waited: float):
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+
+# Flow of the running request in llm_scheduler: its client address, set
+# by the controller (None = all such requests share one flow)
+current_flow: ContextVar = ContextVar("scheduler_flow", default=None)
+
+
+class SessionTurns:
+    """
+    Runs the messages of one session one after another, in arrival order.
+
+    Without this, two messages of the same session could both read the
+    history before either saved its reply, and the turns would get mixed
+    up. Different sessions still run concurrently.
+
+    At most max_pending messages per session may be running or waiting;
+    more are rejected with SessionBusy.
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        # session_id -> [asyncio.Lock, messages running or waiting]
+        self._sessions = {}
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        """
+        async with session_turns.turn(session_id):
+            ... read history, generate, save ...
+        """
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = [asyncio.Lock(), 0]
+
+        if entry[1] >= self.max_pending:
+            self.rejected += 1
+            errors.inc("session_busy")
+            raise SessionBusy("Too many messages pending for this session", 1)
+
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._sessions[session_id]
+
+    def stats(self) -> dict:
+        """
+        Sessions with work in progress and rejection counter.
+        """
+        return {
+            "busy_sessions": len(self._sessions),
+            "rejected": self.rejected,
+        }
+
+
+# Shared scheduler for all LLM calls
+llm_scheduler = AdmissionController(
+    max_concurrent=LLM_MAX_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+)
+
+# Shared per-session ordering
+session_turns = SessionTurns(max_pending=SESSION_MAX_PENDING)
@@ -0,0 +1,153 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Opt-in: set SEMANTIC_CACHE_ENABLED=1 to turn it on
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+# Max cached replies
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "10000"))
+# Min cosine similarity to count as the same question
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+# Only messages with at most this many history messages before them
+# are looked up (0 = first turn only)
+SEMANTIC_CACHE_MAX_HISTORY = int(os.getenv("SEMANTIC_CACHE_MAX_HISTORY", "0"))
+# Embedding size (memory = size * dim * 4 bytes)
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "256"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def embed(text: str, dim: int = SEMANTIC_CACHE_DIM):
+    """
+    Local embedding: hashed character 3-grams + words.
+
+    Each n-gram is hashed to one of `dim` buckets with a +1/-1 sign,
+    and the vector is normalized to length 1, so a dot product is the
+    cosine similarity. Returns None for empty text.
+    """
+    text = " ".join(_PUNCTUATION.sub("", text.lower()).split())
+    if not text:
+        return None
+
+    padded = f" {text} "
+    grams = [padded[i:i + 3] for i in range(len(padded) - 2)] + text.split()
+    hashes = np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) for gram in grams),
+        dtype=np.uint32,
+        count=len(grams),
+    )
+
+    buckets = hashes % dim
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    vec = np.bincount(buckets, weights=signs, minlength=dim).astype(np.float32)
+
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        return None
+    return vec / norm
+
+
+class SemanticCache:
+    """
+    Returns a cached reply for a message that means the same thing
+    as one answered before ("hi, what can you do?" ~ "What can you do").
+
+    All embeddings live in one NumPy matrix (one row per reply), so a
+    lookup is a single matrix-vector product. Replies only match when
+    their context (model, options, earlier history) is the same.
+
+    When full, the least recently used row is overwritten.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, dim: int = SEMANTIC_CACHE_DIM):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dim = dim
+
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._contexts = np.zeros(max_entries, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._replies = [None] * max_entries
+        self._count = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, context: str, text: str):
+        """
+        Cached reply for the most similar message, or None.
+        """
+        vec = embed(text, self.dim)
+        if vec is None:
+            return None
+
+        with self._lock:
+            n = self._count
+            if n == 0:
+                self.misses += 1
+                return None
+
+            scores = self._vectors[:n] @ vec
+            # Ignore rows from a different context
+            scores[self._contexts[:n] != hash(context)] = -1.0
+            best = int(np.argmax(scores))
+
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            return self._replies[best]
+
+    def insert(self, context: str, text: str, reply: str):
+        """
+        Remember the reply to a message.
+        """
+        vec = embed(text, self.dim)
+        if vec is None:
+            return
+
+        with self._lock:
+            if self._count < self.max_entries:
+                row = self._count
+                self._count += 1
+            else:
+                row = int(np.argmin(self._last_used))
+                self.evictions += 1
+
+            self._clock += 1
+            self._vectors[row] = vec
+            self._contexts[row] = hash(context)
+            self._last_used[row] = self._clock
+            self._replies[row] = reply
+
+    def stats(self) -> dict:
+        """
+        Size and hit/miss counters (for monitoring).
+        """
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Shared cache used by the chat service (None when disabled)
+semantic_cache = (
+    SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+    if SEMANTIC_CACHE_ENABLED
+    else None
+)
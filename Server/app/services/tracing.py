@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# How many of the slowest traces /debug/traces keeps
+TRACE_SLOWEST = int(os.getenv("TRACE_SLOWEST", "50"))
+
+
+class Trace:
+    """
+    Timeline of one request: named spans with their start offset and
+    duration (both in seconds, relative to the start of the request).
+    """
+
+    __slots__ = ("request_id", "name", "start", "wall_start", "duration", "spans", "attrs")
+
+    def __init__(self, name: str, request_id: str = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.duration = None
+        # (name, offset, duration)
+        self.spans = []
+        self.attrs = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """
+        Spans finished so far as a Server-Timing header value.
+        """
+        parts = [f"{name};dur={duration * 1000:.1f}" for name, _, duration in self.spans]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.wall_start,
+            "duration_ms": round((self.duration or self.elapsed()) * 1000, 3),
+            "attrs": self.attrs,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, offset, duration in self.spans
+            ],
+        }
+
+
+class SlowestTraces:
+    """
+    Keeps the `size` slowest finished traces (a min-heap, so adding one
+    is O(log size) and fast requests are dropped after one comparison).
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        entry = (trace.duration, next(self._seq), trace)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif trace.duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self) -> list:
+        """
+        Slowest first.
+        """
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        return [trace.to_dict() for _, _, trace in entries]
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+
+
+slowest_traces = SlowestTraces(TRACE_SLOWEST)
+
+# Trace of the request being handled (None outside a traced request)
+_current = ContextVar("current_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    with span("prompt"):
+        ... timed code ...
+
+    Does nothing outside a traced request.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, start - trace.start, time.perf_counter() - start))
+
+
+def record_span(name: str, start: float, end: float = None):
+    """
+    Add a span measured by hand (start/end from time.perf_counter()),
+    for stages that don't fit in one with-block.
+    """
+    trace = _current.get()
+    if trace is not None:
+        end = time.perf_counter() if end is None else end
+        trace.spans.append((name, start - trace.start, end - start))
+
+
+def annotate(**attrs):
+    """
+    Attach details (session id, cache hit, ...) to the current trace.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def traced(name: str, request_id: str = None):
+    """
+    Trace everything inside the block as one request:
+
+        with traced("websocket_chat") as trace:
+            ...
+    """
+    trace = Trace(name, request_id)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        finish(trace)
+
+
+def finish(trace: Trace):
+    if trace.duration is None:
+        trace.duration = trace.elapsed()
+        slowest_traces.add(trace)
+
+
+class TracingMiddleware:
+    """
+    Traces every HTTP request.
+
+    - takes the request ID from the X-Request-ID header (or makes one)
+      and sends it back in the response
+    - adds a Server-Timing header with the spans finished before the
+      response started (for streaming replies: up to the first chunk)
+    - the trace ends when the last body chunk is sent
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["path"], Headers(scope=scope).get("x-request-id"))
+        trace.attrs["method"] = scope["method"]
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", trace.request_id)
+                headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                self._finish(scope, trace)
+
+        token = _current.set(trace)
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            self._finish(scope, trace)
+
+    @staticmethod
+    def _finish(scope, trace: Trace):
+        # The router stores the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            trace.name = endpoint.__name__
+        finish(trace)
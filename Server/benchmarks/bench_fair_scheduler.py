@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tail latency of light sessions under a skewed load.
+
+A few heavy clients (think batch jobs) each fire one message in many
+sessions at once, while many light clients send one or two messages in
+a single session. The LLM is simulated with a fixed service time, and
+every message goes through SessionTurns, so only the queue order differs:
+
+  fifo  AdmissionController with one flow for everybody
+  fair  AdmissionController with one flow per client (round-robin)
+
+Run from the Server/ folder:
+  python3 -m benchmarks.bench_fair_scheduler
+"""
+
+import asyncio
+import random
+import time
+
+from app.services.scheduler import AdmissionController, SessionTurns
+
+SLOTS = 4                 # concurrent generations
+SERVICE_TIME = 0.02       # seconds per simulated generation
+HEAVY_CLIENTS = 3
+HEAVY_BURST = 100         # sessions per heavy client, one message each, sent at once
+LIGHT_CLIENTS = 200
+LIGHT_MAX_MESSAGES = 2
+ARRIVAL_WINDOW = 2.0      # light sessions start within this many seconds
+
+
+def percentile(samples: list, pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run(policy: str, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    admission = AdmissionController(SLOTS, max_queue=10**6, queue_timeout=3600)
+    turns = SessionTurns(max_pending=10**6)
+    latencies = {"heavy": [], "light": []}
+
+    async def message(client: str, session_id: str, kind: str):
+        start = time.perf_counter()
+        async with turns.turn(session_id):
+            async with admission.slot(client if policy == "fair" else None):
+                await asyncio.sleep(SERVICE_TIME)
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def light_client(i: int):
+        await asyncio.sleep(rng.uniform(0, ARRIVAL_WINDOW))
+        for _ in range(rng.randint(1, LIGHT_MAX_MESSAGES)):
+            await message(f"light-{i}", f"light-{i}", "light")
+
+    tasks = [
+        message(f"heavy-{h}", f"heavy-{h}-{s}", "heavy")
+        for h in range(HEAVY_CLIENTS)
+        for s in range(HEAVY_BURST)
+    ]
+    tasks += [light_client(i) for i in range(LIGHT_CLIENTS)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    done = len(latencies["heavy"]) + len(latencies["light"])
+    return {"latencies": latencies, "throughput": done / elapsed}
+
+
+def main() -> int:
+    print(f"{SLOTS} slots, {SERVICE_TIME * 1000:.0f} ms per generation, "
+          f"{HEAVY_CLIENTS} heavy clients x {HEAVY_BURST} sessions, "
+          f"{LIGHT_CLIENTS} light clients\n")
+    print(f"{'policy':>6} {'kind':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'msg/s':>7}")
+    for policy in ("fifo", "fair"):
+        result = asyncio.run(run(policy))
+        for kind in ("light", "heavy"):
+            samples = result["latencies"][kind]
+            print(
+                f"{policy:>6} {kind:>6} "
+                f"{percentile(samples, 50) * 1000:>8.0f} "
+                f"{percentile(samples, 95) * 1000:>8.0f} "
+                f"{percentile(samples, 99) * 1000:>8.0f} "
+                f"{result['throughput']:>7.0f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
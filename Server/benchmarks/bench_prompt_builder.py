@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-turn prompt build cost as a session grows.
+
+Compares the old approach (format the whole history every turn)
+with the cached per-session PromptBuilder. The incremental column should
+stay nearly flat; what growth is left is the single memcpy of the final
+prompt string, which has to be sent to Ollama anyway.
+
+Run from the Server/ folder:
+  python3 -m benchmarks.bench_prompt_builder
+"""
+
+import time
+
+from app.services.prompt_builder import PromptBuilder, build_prompt
+
+CHECKPOINTS = [10, 100, 250, 500, 1000, 2000]
+SAMPLE_TURNS = 50          # turns measured around each checkpoint
+MESSAGE = "Could you explain that last part again in a bit more detail? " * 3
+
+
+def time_turns(build, history: list, turns: int) -> float:
+    """
+    Simulate `turns` chat turns and return the mean build time in microseconds.
+    """
+    total = 0.0
+    for _ in range(turns):
+        start = time.perf_counter()
+        build(history, MESSAGE)
+        total += time.perf_counter() - start
+
+        history.append({"role": "user", "content": MESSAGE})
+        history.append({"role": "assistant", "content": MESSAGE})
+    return total / turns * 1e6
+
+
+def main() -> int:
+    builder = PromptBuilder()
+
+    def cached(history, message):
+        return builder.build("bench", history, message)
+
+    full_history = []
+    cached_history = []
+
+    print(f"{'turns':>8} {'full rebuild (us)':>20} {'incremental (us)':>20}")
+    done = 0
+    for checkpoint in CHECKPOINTS:
+        # Grow both sessions to the checkpoint (not measured)
+        while done < checkpoint:
+            for history in (full_history, cached_history):
+                history.append({"role": "user", "content": MESSAGE})
+                history.append({"role": "assistant", "content": MESSAGE})
+            done += 1
+
+        # Catch the cache up with the unmeasured turns
+        cached(cached_history, MESSAGE)
+
+        full_us = time_turns(build_prompt, full_history, SAMPLE_TURNS)
+        cached_us = time_turns(cached, cached_history, SAMPLE_TURNS)
+        done += SAMPLE_TURNS
+
+        print(f"{checkpoint:>8} {full_us:>20.1f} {cached_us:>20.1f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
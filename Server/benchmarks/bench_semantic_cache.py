@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: semantic cache lookup latency at 100k entries.
+
+Fills a SemanticCache with synthetic questions, then times lookups
+(embedding + vectorized cosine search) for paraphrases and for
+unrelated questions.
+
+Run from the Server/ folder:
+  python3 -m benchmarks.bench_semantic_cache [entries] [dim]
+"""
+
+import random
+import sys
+import time
+
+from app.services.semantic_cache import (
+    SEMANTIC_CACHE_DIM,
+    SEMANTIC_CACHE_THRESHOLD,
+    SemanticCache,
+)
+
+WORDS = (
+    "python server model memory cache token stream socket session database "
+    "install error deploy docker linux windows network request response timeout "
+    "password account email invoice refund order shipping price discount login"
+).split()
+TEMPLATES = [
+    "How do I fix the {} {} problem?",
+    "What is the best way to set up {} with {}?",
+    "Can you explain {} and {} to me?",
+    "Why does my {} keep failing after {}?",
+]
+# Questions on other topics, which should all miss
+OTHER_TEMPLATES = [
+    "Write a short poem about {} in the {}.",
+    "Translate '{}' into {} for me.",
+    "Who won the {} final in {}?",
+]
+OTHER_WORDS = "autumn rain ocean french german spanish football tennis chess 1998 2010 mountains".split()
+LOOKUPS = 1000
+
+
+def question(rng: random.Random) -> str:
+    a, b = rng.sample(WORDS, 2)
+    return rng.choice(TEMPLATES).format(f"{a}{rng.randrange(10**6)}", b)
+
+
+def other_question(rng: random.Random) -> str:
+    a, b = rng.sample(OTHER_WORDS, 2)
+    return rng.choice(OTHER_TEMPLATES).format(a, b)
+
+
+def percentile(samples: list, pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def time_lookups(cache: SemanticCache, queries: list):
+    latencies = []
+    hits = 0
+    for text in queries:
+        start = time.perf_counter()
+        reply = cache.lookup("bench", text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += reply is not None
+    return latencies, hits
+
+
+def main() -> int:
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else SEMANTIC_CACHE_DIM
+    rng = random.Random(42)
+    cache = SemanticCache(entries, SEMANTIC_CACHE_THRESHOLD, dim)
+
+    start = time.perf_counter()
+    stored = []
+    for i in range(entries):
+        text = question(rng)
+        stored.append(text)
+        cache.insert("bench", text, f"reply {i}")
+    fill_s = time.perf_counter() - start
+    print(f"filled {entries} entries (dim {dim}) in {fill_s:.1f}s ({fill_s / entries * 1e6:.0f} us/insert)")
+
+    # Paraphrases: different casing / punctuation / filler words
+    paraphrases = [
+        "hi, " + text.lower().rstrip("?") + " please"
+        for text in rng.sample(stored, LOOKUPS)
+    ]
+    unrelated = [other_question(rng) for _ in range(LOOKUPS)]
+
+    print(f"{'queries':>12} {'hit rate':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, queries in (("paraphrase", paraphrases), ("unrelated", unrelated)):
+        latencies, hits = time_lookups(cache, queries)
+        print(
+            f"{name:>12} {hits / len(queries):>9.1%} "
+            f"{percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f} "
+            f"{percentile(latencies, 99):>8.2f}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
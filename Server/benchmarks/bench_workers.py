@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark: API throughput vs. number of uvicorn worker processes.
+
+Starts the fake Ollama server (fast decode, so the API itself is the
+bottleneck), then for each worker count starts
+`uvicorn app.main:app --workers N` on a fresh SQLite database (shared
+sessions turn on by themselves in uvicorn worker processes) and drives it with the load generator (POST /chat, no
+think time).
+
+After each run, every prompt the fake model received is checked: the
+prompt of a session's turn k must contain turns 0..k-1 of that session.
+With per-worker memory only (CHAT_SHARED_SESSIONS=0), turns of one
+session landing on different workers see different histories and fail
+this check; with shared sessions they all see the same one.
+
+Run from the Server/ folder:
+  python3 -m benchmarks.bench_workers [worker counts...]
+  python3 -m benchmarks.bench_workers 1 2 4 8
+  CHAT_SHARED_SESSIONS=0 python3 -m benchmarks.bench_workers 2   # without sharing
+"""
+
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load_chat import parse_args, run_transport
+
+FAKE_PORT = 11599
+API_PORT = 8599
+SESSIONS = 200
+TURNS = 5
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+# load_chat tags every message with "(session S, turn T)"
+TURN_TAG = re.compile(r"\(session (\d+), turn (\d+)\)")
+
+
+def check_prompts(prompts: list) -> tuple:
+    """
+    (prompts that contain all earlier turns of their session, all prompts)
+    """
+    good = 0
+    for prompt in prompts:
+        tags = TURN_TAG.findall(prompt)
+        if not tags:
+            continue
+        session, turn = tags[-1]
+        seen = {int(t) for s, t in tags[:-1] if s == session}
+        if seen >= set(range(int(turn))):
+            good += 1
+    return good, len(prompts)
+
+
+def run(workers: int) -> dict:
+    db_dir = tempfile.mkdtemp(prefix="bench-workers-")
+    db_path = os.path.join(db_dir, "chat.db")
+    env = dict(
+        os.environ,
+        CHAT_DB_PATH=db_path,
+        OLLAMA_BASE_URL=f"http://127.0.0.1:{FAKE_PORT}",
+        OLLAMA_BACKEND_CONCURRENCY="256",
+        LLM_MAX_CONCURRENCY="256",
+        LLM_MAX_QUEUE="4096",
+        RESPONSE_CACHE_SIZE="0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(API_PORT),
+         "--workers", str(workers), "--log-level", "warning", "--timeout-keep-alive", "30"],
+        env=env,
+    )
+    try:
+        wait_until_up(f"http://127.0.0.1:{API_PORT}/health")
+        args = parse_args([
+            "--url", f"http://127.0.0.1:{API_PORT}",
+            "--sessions", str(SESSIONS),
+            "--min-turns", str(TURNS), "--max-turns", str(TURNS),
+            "--think-time", "0", "--ramp-up", "0.5",
+        ])
+        args.run_id = f"w{workers}"
+        result = asyncio.run(run_transport(args, "http"))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    prompts = httpx.get(f"http://127.0.0.1:{FAKE_PORT}/_fake/prompts", timeout=30.0).json()["prompts"]
+    result["good_prompts"], result["prompts"] = check_prompts(prompts)
+    return result
+
+
+def main() -> int:
+    worker_counts = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4]
+    fake = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(FAKE_PORT),
+        "--slots", "256", "--decode-tps", "2000", "--reply-tokens", "16", "--prefill-ms", "0",
+        "--record-prompts",
+    ])
+    try:
+        wait_until_up(f"http://127.0.0.1:{FAKE_PORT}/api/version")
+        print(f"{os.cpu_count()} CPUs, {SESSIONS} sessions x {TURNS} turns over POST /chat\n")
+        print(f"{'workers':>7} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'errors':>6} {'consistent':>13}")
+        for workers in worker_counts:
+            r = run(workers)
+            print(
+                f"{workers:>7} {r['throughput_rps']:>7.0f} "
+                f"{r['latency_ms']['p50']:>7.0f} {r['latency_ms']['p95']:>7.0f} {r['latency_ms']['p99']:>7.0f} "
+                f"{sum(r['errors'].values()):>6} {r['good_prompts']:>6}/{r['prompts']:<6}"
+            )
+            if r["errors"]:
+                print(f"{'':>7} errors: {r['errors']}")
+    finally:
+        fake.terminate()
+        fake.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
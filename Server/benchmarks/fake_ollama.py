@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for an Ollama server, for load tests without a model.
+
+Implements the parts of the Ollama HTTP API the chat server uses:
+
+  POST /api/generate   prompt (+ context tokens), streaming or not
+  POST /api/chat       message list, streaming or not
+  GET  /api/version, /api/tags
+
+and behaves like a real model in the ways that matter for performance:
+
+- prefill costs --prefill-ms per input token; the text already in a
+  slot's KV cache (same prefix as its last request, or `context`
+  tokens) is not prefilled again
+- tokens are streamed at --decode-tps tokens per second
+- only --slots requests run at once, up to --max-queue more wait, the
+  rest get 503 (like OLLAMA_NUM_PARALLEL / OLLAMA_MAX_QUEUE)
+- --fail-rate answers 500 before generating, --drop-rate cuts the
+  stream off halfway
+
+Replies depend only on the prompt, so runs are reproducible (failures
+use their own seeded generator). Settings can be read and changed at
+runtime with GET/POST /_fake/config. With --record-prompts, every
+prompt is kept and GET /_fake/prompts returns (and clears) them.
+
+Run from the Server/ folder:
+  python3 -m benchmarks.fake_ollama --port 11434 --slots 4 --decode-tps 30
+"""
+
+import argparse
+import asyncio
+from contextlib import aclosing
+from datetime import datetime, timezone
+import hashlib
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+CHARS_PER_TOKEN = 4
+WORDS = (
+    "the a model answer question server token stream cache memory session python "
+    "request reply simple example because however therefore first second finally "
+    "data value result fast slow local network system test run build check"
+).split()
+
+
+class Settings:
+    def __init__(self, args):
+        self.prefill_ms = args.prefill_ms
+        self.decode_tps = args.decode_tps
+        self.reply_tokens = args.reply_tokens
+        self.fail_rate = args.fail_rate
+        self.drop_rate = args.drop_rate
+        self.max_queue = args.max_queue
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class Slot:
+    """
+    One parallel sequence of the model, with the text in its KV cache.
+    """
+
+    def __init__(self):
+        self.cached = ""
+
+
+class FakeOllama:
+    def __init__(self, args):
+        self.settings = Settings(args)
+        self.model = args.model
+        self.slots = [Slot() for _ in range(args.slots)]
+        self.free = asyncio.Queue()
+        for slot in self.slots:
+            self.free.put_nowait(slot)
+        self.waiting = 0
+        self.failures = random.Random(args.seed)
+        self.prompts = [] if args.record_prompts else None
+
+        # Counters
+        self.requests = 0
+        self.rejected = 0
+        self.prefilled_tokens = 0
+        self.reused_tokens = 0
+
+    def reply_tokens(self, text: str, options: dict) -> list:
+        """
+        Deterministic reply for a prompt: same prompt, same words.
+        """
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        count = self.settings.reply_tokens
+        if options.get("num_predict", -1) >= 0:
+            count = min(count, options["num_predict"])
+        tokens = [(" " if i else "") + rng.choice(WORDS) for i in range(count)]
+        if tokens:
+            tokens[-1] += "."
+        return tokens
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "waiting": self.waiting,
+            "busy_slots": len(self.slots) - self.free.qsize(),
+            "prefilled_tokens": self.prefilled_tokens,
+            "reused_tokens": self.reused_tokens,
+        }
+
+
+def common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+# Our context "tokens" pack CHARS_PER_TOKEN characters of the text each,
+# so a context is about as long as a real one and turns back into the text
+_BASE = 0x110001
+
+
+def text_to_context(text: str) -> list:
+    context = []
+    for i in range(0, len(text), CHARS_PER_TOKEN):
+        value = 0
+        for ch in text[i:i + CHARS_PER_TOKEN]:
+            value = value * _BASE + ord(ch) + 1
+        context.append(value)
+    return context
+
+
+def context_to_text(context: list) -> str:
+    parts = []
+    for value in context:
+        chars = []
+        while value:
+            value, code = divmod(value, _BASE)
+            chars.append(chr(code - 1))
+        parts.append("".join(reversed(chars)))
+    return "".join(parts)
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    fake = FakeOllama(args)
+
+    async def acquire_slot(text: str):
+        """
+        Pick a free slot, preferring the one whose cache shares the longest
+        prefix with `text` (like Ollama's prompt cache).
+        """
+        slot = await fake.free.get()
+        others = []
+        while not fake.free.empty():
+            others.append(fake.free.get_nowait())
+        best = max([slot] + others, key=lambda s: common_prefix(s.cached, text))
+        for s in [slot] + others:
+            if s is not best:
+                fake.free.put_nowait(s)
+        return best
+
+    async def generate(kind: str, text: str, body: dict):
+        fake.requests += 1
+        if fake.prompts is not None:
+            fake.prompts.append(text)
+        settings = fake.settings
+        options = body.get("options") or {}
+        stream = body.get("stream", True)
+
+        if fake.waiting >= settings.max_queue and fake.free.empty():
+            fake.rejected += 1
+            return JSONResponse({"error": "server busy, please try again"}, status_code=503)
+        if fake.failures.random() < settings.fail_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        drop = fake.failures.random() < settings.drop_rate
+
+        fake.waiting += 1
+        try:
+            slot = await acquire_slot(text)
+        finally:
+            fake.waiting -= 1
+
+        tokens = fake.reply_tokens(text, options)
+        stop = options.get("stop") or []
+
+        async def run():
+            """
+            Yields (token, done) pairs with realistic timing.
+            """
+            start = time.perf_counter()
+            try:
+                reused = common_prefix(slot.cached, text)
+                prefill = (len(text) - reused) // CHARS_PER_TOKEN
+                fake.prefilled_tokens += prefill
+                fake.reused_tokens += reused // CHARS_PER_TOKEN
+                await asyncio.sleep(prefill * settings.prefill_ms / 1000)
+                prefilled = time.perf_counter()
+
+                reply = ""
+                generated = 0
+                for i, token in enumerate(tokens):
+                    if drop and i == len(tokens) // 2:
+                        raise ConnectionResetError("injected stream drop")
+                    if any(s in reply + token for s in stop):
+                        break
+                    await asyncio.sleep(1 / settings.decode_tps)
+                    reply += token
+                    generated += 1
+                    yield token, None
+
+                slot.cached = text + reply
+                end = time.perf_counter()
+                yield "", {
+                    "total_duration": int((end - start) * 1e9),
+                    "load_duration": 0,
+                    "prompt_eval_count": prefill,
+                    "prompt_eval_duration": int((prefilled - start) * 1e9),
+                    "eval_count": generated,
+                    "eval_duration": int((end - prefilled) * 1e9),
+                    "context": text_to_context(text + reply),
+                    "reply": reply,
+                }
+            finally:
+                fake.free.put_nowait(slot)
+
+        def chunk(token: str, final: dict = None) -> dict:
+            data = {"model": fake.model, "created_at": datetime.now(timezone.utc).isoformat()}
+            if kind == "chat":
+                data["message"] = {"role": "assistant", "content": token if final is None else ""}
+            else:
+                data["response"] = token if final is None else ""
+            data["done"] = final is not None
+            if final is not None:
+                data["done_reason"] = "stop"
+                data.update({k: v for k, v in final.items() if k != "reply"})
+                if kind == "chat":
+                    del data["context"]
+            return data
+
+        if not stream:
+            final = None
+            async for _, final in run():
+                pass
+            data = chunk("", final)
+            if kind == "chat":
+                data["message"]["content"] = final["reply"]
+            else:
+                data["response"] = final["reply"]
+            return JSONResponse(data)
+
+        async def ndjson():
+            # aclosing: free the slot right away if the client goes away
+            async with aclosing(run()) as tokens_out:
+                async for token, final in tokens_out:
+                    yield json.dumps(chunk(token, final)) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def api_generate(request: Request):
+        body = await request.json()
+        text = context_to_text(body.get("context") or []) + (body.get("prompt") or "")
+        if not text:
+            # Empty prompt only loads the model
+            return {"model": fake.model, "response": "", "done": True, "done_reason": "load"}
+        return await generate("generate", text, body)
+
+    @app.post("/api/chat")
+    async def api_chat(request: Request):
+        body = await request.json()
+        text = "".join(f"{m['role']}: {m['content']}\n" for m in body.get("messages", [])) + "assistant:"
+        return await generate("chat", text, body)
+
+    @app.get("/api/version")
+    def api_version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/tags")
+    def api_tags():
+        return {"models": [{"name": fake.model, "model": fake.model}]}
+
+    @app.get("/_fake/prompts")
+    def get_prompts():
+        prompts = fake.prompts or []
+        if fake.prompts is not None:
+            fake.prompts = []
+        return {"prompts": prompts}
+
+    @app.get("/_fake/config")
+    def get_config():
+        return {"settings": fake.settings.to_dict(), "stats": fake.stats()}
+
+    @app.post("/_fake/config")
+    async def set_config(request: Request):
+        """
+        Change settings while running, e.g. {"fail_rate": 1.0} to take
+        the "backend" down for circuit breaker tests.
+        """
+        for key, value in (await request.json()).items():
+            if hasattr(fake.settings, key):
+                setattr(fake.settings, key, type(getattr(fake.settings, key))(value))
+        return {"settings": fake.settings.to_dict()}
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Ollama server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="phi3:latest")
+    parser.add_argument("--prefill-ms", type=float, default=0.5, help="milliseconds per prompt token")
+    parser.add_argument("--decode-tps", type=float, default=30.0, help="generated tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=48, help="tokens per reply (capped by num_predict)")
+    parser.add_argument("--slots", type=int, default=4, help="requests generated in parallel")
+    parser.add_argument("--max-queue", type=int, default=512, help="requests waiting for a slot before 503")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of streams cut off halfway")
+    parser.add_argument("--seed", type=int, default=0, help="seed for failure injection")
+    parser.add_argument("--record-prompts", action="store_true", help="keep prompts for GET /_fake/prompts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Load generator for a running chat server.
+
+Simulates many users chatting at once. Each simulated session sends a
+random number of messages, waiting a random "think time" between them,
+over one of the transports:
+
+  http  POST /chat          (latency only)
+  sse   POST /chat/stream   (latency + time to first token)
+  ws    /ws, streaming      (latency + time to first token, one
+                             connection per session)
+
+Reports throughput, p50/p95/p99 latency and TTFT per transport, and can
+write them as JSON and compare them with an earlier run to catch
+regressions between releases.
+
+Run the server first (without a model, point it at fake_ollama.py):
+  python3 -m benchmarks.fake_ollama --port 11434 &
+  uvicorn app.main:app --port 8000
+
+Then, from the Server/ folder:
+  python3 -m benchmarks.load_chat --transport http ws --sessions 100
+  python3 -m benchmarks.load_chat --json results.json
+  python3 -m benchmarks.load_chat --compare results.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+
+import httpx
+import websockets
+
+QUESTIONS = [
+    "What is the capital of France?",
+    "Explain how a hash map works.",
+    "Write a haiku about the sea.",
+    "How do I reverse a list in Python?",
+    "What causes rain?",
+    "Give me three tips for better sleep.",
+    "What is the difference between TCP and UDP?",
+    "Summarize the plot of Hamlet in two sentences.",
+]
+
+
+def percentile(samples: list, pct: float):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class Results:
+    """
+    Latencies, TTFTs and errors of one transport.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.errors = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        ms = lambda value: None if value is None else round(value * 1000, 2)
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "throughput_rps": round(len(self.latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {f"p{p}": ms(percentile(self.latencies, p)) for p in (50, 95, 99)},
+            "ttft_ms": {f"p{p}": ms(percentile(self.ttfts, p)) for p in (50, 95, 99)},
+        }
+
+
+def make_message(rng: random.Random, session: int, turn: int, repeat_ratio: float) -> str:
+    question = rng.choice(QUESTIONS)
+    if rng.random() < repeat_ratio:
+        # Same text as other sessions -> can be served from the response cache
+        return question
+    return f"{question} (session {session}, turn {turn})"
+
+
+async def http_turn(client: httpx.AsyncClient, results: Results, session_id: str, message: str):
+    start = time.perf_counter()
+    resp = await client.post("/chat", json={"session_id": session_id, "message": message})
+    if resp.status_code != 200:
+        results.error(f"http_{resp.status_code}")
+        return
+    results.latencies.append(time.perf_counter() - start)
+
+
+async def sse_turn(client: httpx.AsyncClient, results: Results, session_id: str, message: str):
+    start = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/chat/stream", json={"session_id": session_id, "message": message}) as resp:
+        if resp.status_code != 200:
+            results.error(f"http_{resp.status_code}")
+            return
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if first is None and "delta" in event:
+                first = time.perf_counter()
+            if event.get("done"):
+                break
+
+    results.latencies.append(time.perf_counter() - start)
+    if first is not None:
+        results.ttfts.append(first - start)
+
+
+async def ws_turn(ws, results: Results, session_id: str, message: str):
+    start = time.perf_counter()
+    first = None
+    await ws.send(json.dumps({"session_id": session_id, "message": message, "stream": True}))
+    while True:
+        frame = json.loads(await ws.recv())
+        if "error" in frame:
+            results.error("ws_error")
+            return
+        if first is None and "delta" in frame:
+            first = time.perf_counter()
+        if frame.get("done"):
+            break
+
+    results.latencies.append(time.perf_counter() - start)
+    if first is not None:
+        results.ttfts.append(first - start)
+
+
+async def run_session(args, transport: str, session: int, client, results: Results, rng: random.Random):
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    # Fresh session ids every run, so histories don't carry over between runs
+    session_id = f"load-{args.run_id}-{transport}-{session}"
+    turns = rng.randint(args.min_turns, args.max_turns)
+
+    ws = None
+    try:
+        if transport == "ws":
+            ws = await websockets.connect(args.url.replace("http", "ws", 1) + "/ws", max_size=None)
+
+        for turn in range(turns):
+            message = make_message(rng, session, turn, args.repeat_ratio)
+            try:
+                if transport == "http":
+                    await http_turn(client, results, session_id, message)
+                elif transport == "sse":
+                    await sse_turn(client, results, session_id, message)
+                else:
+                    await ws_turn(ws, results, session_id, message)
+            except (httpx.HTTPError, websockets.WebSocketException, OSError) as e:
+                results.error(type(e).__name__)
+
+            if args.think_time and turn < turns - 1:
+                # Exponential think time, like real users
+                await asyncio.sleep(rng.expovariate(1 / args.think_time))
+    except (websockets.WebSocketException, OSError) as e:
+        results.error(type(e).__name__)
+    finally:
+        if ws is not None:
+            await ws.close()
+
+
+async def run_transport(args, transport: str) -> dict:
+    rng = random.Random(f"{args.seed}-{transport}")
+    results = Results()
+    # Drop idle connections before uvicorn's 5 s keep-alive timeout closes them
+    limits = httpx.Limits(
+        max_connections=args.sessions,
+        max_keepalive_connections=args.sessions,
+        keepalive_expiry=4.0,
+    )
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_session(args, transport, session, client, results, random.Random(rng.random()))
+            for session in range(args.sessions)
+        ))
+        elapsed = time.perf_counter() - start
+
+    summary = results.summary(elapsed)
+    summary["elapsed_s"] = round(elapsed, 3)
+    return summary
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Regressions of current vs baseline (p95 latency/TTFT up or
+    throughput down by more than `tolerance`).
+    """
+    problems = []
+    for transport, result in current.items():
+        base = baseline.get(transport)
+        if base is None:
+            continue
+        for metric in ("latency_ms", "ttft_ms"):
+            now, before = result[metric]["p95"], base[metric]["p95"]
+            if now is not None and before and now > before * (1 + tolerance):
+                problems.append(f"{transport} {metric} p95 {before} -> {now}")
+        now, before = result["throughput_rps"], base["throughput_rps"]
+        if before and now < before * (1 - tolerance):
+            problems.append(f"{transport} throughput {before} -> {now} req/s")
+    return problems
+
+
+def print_table(results: dict):
+    fmt = lambda value: "-" if value is None else f"{value:.0f}"
+    print(f"{'transport':>9} {'reqs':>6} {'errors':>6} {'req/s':>7} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'ttft50':>7} {'ttft95':>7} {'ttft99':>7}")
+    for transport, r in results.items():
+        print(
+            f"{transport:>9} {r['requests']:>6} {sum(r['errors'].values()):>6} {r['throughput_rps']:>7.1f} "
+            + " ".join(f"{fmt(r['latency_ms'][p]):>7}" for p in ("p50", "p95", "p99")) + " "
+            + " ".join(f"{fmt(r['ttft_ms'][p]):>7}" for p in ("p50", "p95", "p99"))
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the chat server.")
+    parser.add_argument("--url", default="http://localhost:8000", help="server base URL")
+    parser.add_argument("--transport", nargs="+", choices=("http", "sse", "ws"), default=["http", "ws"])
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent simulated sessions")
+    parser.add_argument("--min-turns", type=int, default=1, help="fewest messages per session")
+    parser.add_argument("--max-turns", type=int, default=5, help="most messages per session")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between messages (0 = none)")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="sessions start within this many seconds")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of messages repeated across sessions")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    parser.add_argument("--compare", help="earlier --json results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed regression (0.1 = 10%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    args.run_id = uuid.uuid4().hex[:8]
+    results = {transport: asyncio.run(run_transport(args, transport)) for transport in args.transport}
+
+    print_table(results)
+
+    if args.json:
+        report = {"config": vars(args), "results": results}
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())